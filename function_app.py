@@ -1,13 +1,55 @@
 import azure.functions as func
+import azure.durable_functions as df
+import asyncio
 import logging
+import httpx
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
 import os
+import hashlib
+import heapq
+import json
+import math
+import multiprocessing
+import random
+import threading
+import time
+import uuid
+import zipfile
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import LETTER
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.lib import colors
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.platypus import LongTable, Paragraph, SimpleDocTemplate, Spacer, TableStyle
+from xml.sax.saxutils import escape
+from pypdf import PdfReader, PdfWriter
 from io import BytesIO
-import textwrap
+import tempfile
+import re
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from itertools import chain
+from operator import attrgetter
+from typing import Any, List, Optional
+from urllib.parse import quote
 
-app = func.FunctionApp()
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+app = df.DFApp()
 
 # ------------------------------------------------------------
 # CONFIGURATION
@@ -21,180 +63,2292 @@ HEADERS = {
     "authorization": f"Bearer {ONETRUST_TOKEN}"
 }
 
+# Attribute columns shown for each control, as comma-separated
+# "attributeKey=Label" pairs. SCORE_ATTRIBUTE (default: the first one)
+# feeds the average and the score statistics. Invalid settings are
+# logged and replaced by the defaults rather than failing every function.
+DEFAULT_REPORT_ATTRIBUTES = "AttributeFormulaValue.value1_2=Value"
+
+
+def parse_report_attributes(value):
+    attributes = []
+    for entry in filter(None, (e.strip() for e in value.split(","))):
+        key, _, label = entry.partition("=")
+        if key.strip():
+            attributes.append((key.strip(), label.strip() or key.strip()))
+    return attributes
+
+
+REPORT_ATTRIBUTES = parse_report_attributes(
+    os.getenv("REPORT_ATTRIBUTES", DEFAULT_REPORT_ATTRIBUTES)
+)
+if not REPORT_ATTRIBUTES:
+    logging.error(
+        "REPORT_ATTRIBUTES has no attribute keys, using %s", DEFAULT_REPORT_ATTRIBUTES
+    )
+    REPORT_ATTRIBUTES = parse_report_attributes(DEFAULT_REPORT_ATTRIBUTES)
+ATTRIBUTE_KEYS = tuple(key for key, _ in REPORT_ATTRIBUTES)
+ATTRIBUTE_LABELS = tuple(label for _, label in REPORT_ATTRIBUTES)
+SCORE_ATTRIBUTE = os.getenv("SCORE_ATTRIBUTE", ATTRIBUTE_KEYS[0])
+if SCORE_ATTRIBUTE not in ATTRIBUTE_KEYS:
+    logging.error(
+        "SCORE_ATTRIBUTE %s is not one of REPORT_ATTRIBUTES (%s), scoring %s instead",
+        SCORE_ATTRIBUTE, ", ".join(ATTRIBUTE_KEYS), ATTRIBUTE_KEYS[0]
+    )
+    SCORE_ATTRIBUTE = ATTRIBUTE_KEYS[0]
+SCORE_INDEX = ATTRIBUTE_KEYS.index(SCORE_ATTRIBUTE)
+
+# Page decoder: "auto" (msgspec, then orjson, then stdlib), "msgspec",
+# "orjson" or "json".
+JSON_DECODER = os.getenv("JSON_DECODER", "auto").lower()
+
+PAGE_SIZE_MIN = int(os.getenv("PAGE_SIZE_MIN", "50"))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "500"))
+PAGE_SIZE_REJECTED = (400, 413, 422)
+# How long a stepped-down page size is remembered before the next fetch
+# probes from PAGE_SIZE_MAX again, so a transient timeout does not
+# shrink an org's pages for the life of the instance.
+PAGE_SIZE_MEMORY_TTL = float(os.getenv("PAGE_SIZE_MEMORY_TTL", "3600"))
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", "8"))
+
+# Render controls as pages arrive (API order) instead of sorting the
+# whole org in memory first. Can be overridden per request with ?stream=.
+REPORT_STREAMING = os.getenv("REPORT_STREAMING", "false").lower() == "true"
+# STREAM_SORTED makes stream mode merge locally sorted pages into
+# identifier order. The merge needs every page, so it gives up the
+# page-sized memory bound streaming exists for; leave it off for large
+# orgs. SERVER_SORT (e.g. "control.identifier,asc") asks OneTrust to
+# pre-sort, which makes the per-page sorts cheap.
+STREAM_SORTED = os.getenv("STREAM_SORTED", "false").lower() == "true"
+SERVER_SORT = os.getenv("SERVER_SORT", "")
+
+# Chunked PDF responses (report/stream/{org_id}). Needs the
+# azurefunctions-extensions-http-fastapi package and
+# PYTHON_ENABLE_INIT_INDEXING=1 on the Function App.
+PDF_HTTP_STREAMING = os.getenv("PDF_HTTP_STREAMING", "false").lower() == "true"
+PDF_CHUNK_SIZE = int(os.getenv("PDF_CHUNK_SIZE", str(64 * 1024)))
+PDF_SPOOL_MAX_BYTES = int(os.getenv("PDF_SPOOL_MAX_BYTES", str(8 * 1024 * 1024)))
+
+# Fetched-controls cache: "memory", "disk", "tiered" (memory in front of
+# disk) or "none". CONTROLS_CACHE_TTL_OVERRIDES is "org=seconds,...".
+CONTROLS_CACHE_BACKEND = os.getenv("CONTROLS_CACHE_BACKEND", "memory").lower()
+CONTROLS_CACHE_TTL = float(os.getenv("CONTROLS_CACHE_TTL", "900"))
+CONTROLS_CACHE_TTL_OVERRIDES = os.getenv("CONTROLS_CACHE_TTL_OVERRIDES", "")
+CONTROLS_CACHE_MAX_ENTRIES = int(os.getenv("CONTROLS_CACHE_MAX_ENTRIES", "32"))
+# Rendered PDFs, keyed by a hash of the data the report shows.
+PDF_CACHE_ENABLED = os.getenv("PDF_CACHE_ENABLED", "true").lower() == "true"
+PDF_CACHE_MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+PDF_CACHE_MAX_ENTRIES = int(os.getenv("PDF_CACHE_MAX_ENTRIES", "256"))
+PDF_CACHE_TTL = float(os.getenv("PDF_CACHE_TTL", "86400"))
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(tempfile.gettempdir(), "onetrust-report-cache"))
+
+# Incremental sync keeps a per-org snapshot on disk and only asks
+# OneTrust for implementations modified since the last sync.
+INCREMENTAL_SYNC = os.getenv("INCREMENTAL_SYNC", "false").lower() == "true"
+MODIFIED_SINCE_FIELD = os.getenv("MODIFIED_SINCE_FIELD", "lastModifiedDate")
+INCREMENTAL_FULL_SYNC_INTERVAL = float(os.getenv("INCREMENTAL_FULL_SYNC_HOURS", "24")) * 3600
+INCREMENTAL_SKEW = float(os.getenv("INCREMENTAL_SKEW_SECONDS", "300"))
+
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "4"))
+BATCH_MAX_ORGS = int(os.getenv("BATCH_MAX_ORGS", "500"))
+# Batches of up to BATCH_ZIP_MAX_ORGS orgs are built inline and returned
+# as a zip; larger ones (or ?queue=true) are queued as one report job
+# per org and answered with the report locations.
+BATCH_ZIP_MAX_ORGS = int(os.getenv("BATCH_ZIP_MAX_ORGS", "20"))
+
+# Where rendered reports (and orchestration page spills) are stored:
+# a blob container, or a local directory when REPORTS_DIR is set.
+REPORTS_DIR = os.getenv("REPORTS_DIR")
+REPORTS_CONTAINER = os.getenv("REPORTS_CONTAINER", "reports")
+REPORTS_STORAGE_CONNECTION = os.getenv(
+    "REPORTS_STORAGE_CONNECTION", os.getenv("AzureWebJobsStorage")
+)
+
+# Background generation: report/{org_id}?queue=true enqueues a job on
+# REPORT_QUEUE and returns 202. Locally, point AzureWebJobsStorage at
+# Azurite ("UseDevelopmentStorage=true") and set REPORTS_DIR.
+REPORT_QUEUE = os.getenv("REPORT_QUEUE", "report-jobs")
+REPORT_QUEUE_CONNECTION = "AzureWebJobsStorage"
+REPORT_QUEUE_DEFAULT = os.getenv("REPORT_QUEUE_DEFAULT", "false").lower() == "true"
+
+# Timer pre-warming of the controls and PDF caches (NCRONTAB schedule).
+# Pre-warmed controls are cached for PREWARM_CACHE_TTL seconds (never
+# less than their normal TTL), which has to cover the gap between the
+# schedule and the peak it warms for: 07:00 + 3h lasts until 10:00.
+PREWARM_SCHEDULE = os.getenv("PREWARM_SCHEDULE", "0 0 7 * * 1")
+PREWARM_CACHE_TTL = float(os.getenv("PREWARM_CACHE_TTL", str(3 * 3600)))
+PREWARM_ORG_IDS = [
+    org_id.strip()
+    for org_id in os.getenv("PREWARM_ORG_IDS", "").split(",")
+    if org_id.strip()
+]
+
+# Page-level retries with jittered exponential backoff (Retry-After wins
+# when OneTrust sends it), and a token bucket shared by every fetch on
+# the instance. RATE_LIMIT_PER_SECOND=0 disables the bucket.
+RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", "5"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "30"))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RATE_LIMIT_PER_SECOND = float(os.getenv("RATE_LIMIT_PER_SECOND", "10"))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", str(FETCH_WORKERS)))
+
+# Checkpoints of fetched pages so an interrupted fetch resumes where it
+# stopped: "disk" (under CACHE_DIR), "blob" (report storage) or "none".
+# Off by default, as every page is written and deleted once more; worth
+# it for orgs large enough that a fetch may not finish. ?refresh=true
+# never resumes.
+CHECKPOINT_BACKENDS = ("none", "disk", "blob")
+CHECKPOINT_BACKEND = os.getenv("CHECKPOINT_BACKEND", "none").lower()
+if CHECKPOINT_BACKEND not in CHECKPOINT_BACKENDS:
+    logging.error(
+        "Unknown CHECKPOINT_BACKEND %s, expected one of %s; checkpoints are off",
+        CHECKPOINT_BACKEND, ", ".join(CHECKPOINT_BACKENDS)
+    )
+    CHECKPOINT_BACKEND = "none"
+CHECKPOINT_TTL = float(os.getenv("CHECKPOINT_TTL", "3600"))
+
+# Reports of at least RENDER_PARALLEL_MIN_PAGES pages are painted in
+# RENDER_CHUNK_PAGES-page chunks on one shared pool of RENDER_PROCESSES
+# processes (default: the CPUs this process may run on). At most
+# RENDER_PARALLEL_JOBS reports use the pool at once; the rest, e.g.
+# other batch or pre-warm threads, render serially.
+AVAILABLE_CPUS = (
+    len(os.sched_getaffinity(0))
+    if hasattr(os, "sched_getaffinity")
+    else os.cpu_count() or 1
+)
+RENDER_PROCESSES = int(os.getenv("RENDER_PROCESSES", str(AVAILABLE_CPUS)))
+RENDER_PARALLEL_JOBS = int(os.getenv("RENDER_PARALLEL_JOBS", "1"))
+RENDER_PARALLEL_MIN_PAGES = int(os.getenv("RENDER_PARALLEL_MIN_PAGES", "200"))
+RENDER_CHUNK_PAGES = int(os.getenv("RENDER_CHUNK_PAGES", "100"))
+# "lines" (one labelled line per field) or "table" (one row per control).
+# Can be overridden per request with ?layout=.
+REPORT_LAYOUTS = ("lines", "table")
+REPORT_LAYOUT = os.getenv("REPORT_LAYOUT", "lines").lower()
+# Wrapped lines are memoized for strings of up to WRAP_CACHE_MAX_CHARS
+# characters, which bounds the cache at roughly
+# 2 * WRAP_CACHE_SIZE * WRAP_CACHE_MAX_CHARS characters.
+WRAP_CACHE_SIZE = int(os.getenv("WRAP_CACHE_SIZE", "8192"))
+WRAP_CACHE_MAX_CHARS = int(os.getenv("WRAP_CACHE_MAX_CHARS", "512"))
+
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "4"))
+# Batch and pre-warm run BATCH_WORKERS org fetches at once, each with
+# FETCH_WORKERS page threads, all on the shared session. The pool must
+# hold that many connections, or urllib3 opens throwaway ones past it.
+HTTP_POOL_MAXSIZE = int(os.getenv(
+    "HTTP_POOL_MAXSIZE", str(max(FETCH_WORKERS * max(1, BATCH_WORKERS), 10))
+))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+
 # ------------------------------------------------------------
-# FETCH CONTROLS (WITH PAGINATION)
+# HTTP SESSIONS (SHARED ACROSS PAGES AND WARM INVOCATIONS)
 # ------------------------------------------------------------
-def fetch_controls(org_id):
-    controls = []
-    page = 0
-    size = 50
+def build_session():
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    session.verify = False
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
 
-    while True:
-        payload = {
-            "filters": [
-                {
-                    "field": "organizationId",
-                    "operator": "EQUAL_TO",
-                    "value": org_id
-                }
-            ]
-        }
 
-        url = f"{BASE_URL}?page={page}&size={size}"
-        response = requests.post(
-            url,
+SESSION = build_session()
+
+_async_client = None
+_async_client_loop = None
+
+
+def get_async_client():
+    # httpx clients are bound to the loop they were first used on, so a
+    # new one is built if the worker ever hands us a different loop.
+    global _async_client, _async_client_loop
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client_loop is not loop:
+        _async_client = httpx.AsyncClient(
             headers=HEADERS,
-            json=payload,
+            verify=False,
             timeout=60,
-            verify=False
+            limits=httpx.Limits(
+                max_connections=HTTP_POOL_MAXSIZE,
+                max_keepalive_connections=HTTP_POOL_MAXSIZE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+            )
         )
-        response.raise_for_status()
+        _async_client_loop = loop
+    return _async_client
 
-        data = response.json()
-        controls.extend(data.get("content", []))
+# ------------------------------------------------------------
+# CACHE BACKENDS
+# ------------------------------------------------------------
+class MemoryCache:
+    # LRU with a per-entry TTL. When max_bytes is set, values are sized
+    # with len() and the least recently used ones are evicted to fit.
+    def __init__(self, max_entries, ttl, max_bytes=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
 
-        total_pages = data.get("totalPages", 1)
-        page += 1
-        if page >= total_pages:
-            break
+    def _size(self, value):
+        return len(value) if self.max_bytes is not None else 0
 
-    return controls
+    def _pop(self, key):
+        _, value = self._entries.pop(key)
+        self._bytes -= self._size(value)
 
-# ------------------------------------------------------------
-# SORT IDENTIFIERS NUMERICALLY
-# ------------------------------------------------------------
-def identifier_key(item):
-    identifier = (item.get("control") or {}).get("identifier", "")
-    parts = []
-    for part in identifier.split("."):
+    def get_entry(self, key):
+        # (expires, value), or None on a miss.
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                self._pop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        return None if entry is None else entry[1]
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            if self.max_bytes is not None and self._size(value) > self.max_bytes:
+                return
+            self._entries[key] = (expires, value)
+            self._bytes += self._size(value)
+            while len(self._entries) > self.max_entries or (
+                self.max_bytes is not None and self._bytes > self.max_bytes
+            ):
+                self._pop(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+
+
+class DiskCache:
+    # encode/decode map values to and from something json can store.
+    def __init__(self, directory, ttl, encode=None, decode=None):
+        self.directory = directory
+        self.ttl = ttl
+        self.encode = encode or (lambda value: value)
+        self.decode = decode or (lambda value: value)
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def get_entry(self, key):
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry["expires"] < time.time():
+            self.delete(key)
+            return None
+        return entry["expires"], self.decode(entry["value"])
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        return None if entry is None else entry[1]
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        path = self._path(key)
+        # A unique temp file per write, as other threads, processes or
+        # instances sharing CACHE_DIR may be writing the same key.
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"expires": expires, "value": self.encode(value)}, f)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def delete(self, key):
         try:
-            parts.append(int(part))
-        except ValueError:
-            parts.append(0)
-    return parts
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class TieredCache:
+    # A hit in a lower tier is copied into the tiers above it with the
+    # entry's remaining lifetime, not a fresh TTL.
+    def __init__(self, *tiers):
+        self.tiers = tiers
+
+    def get_entry(self, key):
+        for i, tier in enumerate(self.tiers):
+            entry = tier.get_entry(key)
+            if entry is not None:
+                expires, value = entry
+                for upper in self.tiers[:i]:
+                    upper.set(key, value, expires - time.time())
+                return entry
+        return None
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        return None if entry is None else entry[1]
+
+    def set(self, key, value, ttl=None):
+        for tier in self.tiers:
+            tier.set(key, value, ttl)
+
+    def delete(self, key):
+        for tier in self.tiers:
+            tier.delete(key)
+
+
+CACHE_BACKENDS = ("memory", "disk", "tiered", "none")
+
+
+def build_cache(backend, name, max_entries, ttl, encode=None, decode=None):
+    if backend not in CACHE_BACKENDS:
+        logging.error(
+            "Unknown %s cache backend %s, expected one of %s; using memory",
+            name, backend, ", ".join(CACHE_BACKENDS)
+        )
+        backend = "memory"
+    if backend == "none":
+        return None
+    memory = MemoryCache(max_entries, ttl)
+    if backend == "memory":
+        return memory
+    disk = DiskCache(os.path.join(CACHE_DIR, name), ttl, encode, decode)
+    if backend == "disk":
+        return disk
+    return TieredCache(memory, disk)
+
+
+def parse_ttl_overrides(value):
+    overrides = {}
+    for entry in filter(None, (e.strip() for e in value.split(","))):
+        org_id, _, ttl = entry.partition("=")
+        overrides[org_id.strip()] = float(ttl)
+    return overrides
+
+
+CONTROLS_CACHE = build_cache(
+    CONTROLS_CACHE_BACKEND,
+    "controls",
+    CONTROLS_CACHE_MAX_ENTRIES,
+    CONTROLS_CACHE_TTL,
+    encode=lambda controls: dump_controls(controls),
+    decode=lambda values: load_controls(values)
+)
+CONTROLS_CACHE_TTLS = parse_ttl_overrides(CONTROLS_CACHE_TTL_OVERRIDES)
+
+SNAPSHOTS = (
+    DiskCache(
+        os.path.join(CACHE_DIR, "snapshots"),
+        INCREMENTAL_FULL_SYNC_INTERVAL * 2,
+        encode=lambda snapshot: {**snapshot, "controls": dump_controls(snapshot["controls"])},
+        decode=lambda snapshot: {**snapshot, "controls": load_controls(snapshot["controls"])}
+    )
+    if INCREMENTAL_SYNC
+    else None
+)
+
+PDF_CACHE = (
+    MemoryCache(PDF_CACHE_MAX_ENTRIES, PDF_CACHE_TTL, max_bytes=PDF_CACHE_MAX_BYTES)
+    if PDF_CACHE_ENABLED
+    else None
+)
 
 # ------------------------------------------------------------
-# ATTRIBUTE HELPER
+# RETRIES AND RATE LIMITING
 # ------------------------------------------------------------
-def get_attribute_value(item, key):
-    attrs = item.get("attributes") or {}
-    values = attrs.get(key) or []
+class TokenBucket:
+    # Callers reserve a token up front (the balance may go negative) and
+    # sleep off the deficit, so waiters are served in arrival order.
+    # pause() holds everyone back, e.g. for a 429's Retry-After.
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
 
-    if not values:
-        return "N/A"
+    def _reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self.paused_until - now)
+            if self.rate <= 0:
+                return wait
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens < 0:
+                wait = max(wait, -self.tokens / self.rate)
+            return wait
 
-    val = values[0].get("value")
-    if val in (None, "0", 0):
-        return "N/A"
+    def acquire(self):
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+RATE_LIMITER = TokenBucket(RATE_LIMIT_PER_SECOND, RATE_LIMIT_BURST)
+
+
+def parse_retry_after(response):
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_delay(attempt, response=None):
+    retry_after = parse_retry_after(response)
+    if retry_after is not None:
+        return min(retry_after, RETRY_MAX_DELAY)
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+
+def log_retry(url, attempt, delay, reason):
+    logging.warning(
+        "OneTrust request %s failed (%s), retry %s/%s in %.1fs",
+        url, reason, attempt + 1, RETRY_ATTEMPTS, delay
+    )
+
+
+def post_with_retries(url, payload, retry_timeouts=True):
+    for attempt in range(RETRY_ATTEMPTS + 1):
+        RATE_LIMITER.acquire()
+        try:
+            response = SESSION.post(url, json=payload, timeout=60)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == RETRY_ATTEMPTS or (
+                isinstance(e, requests.Timeout) and not retry_timeouts
+            ):
+                raise
+            delay = retry_delay(attempt)
+            reason = type(e).__name__
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt == RETRY_ATTEMPTS:
+                response.raise_for_status()
+                return response
+            delay = retry_delay(attempt, response)
+            reason = response.status_code
+            if response.status_code == 429:
+                RATE_LIMITER.pause(delay)
+
+        log_retry(url, attempt, delay, reason)
+        time.sleep(delay)
 
-    return val
+
+async def post_with_retries_async(client, url, payload, retry_timeouts=True):
+    for attempt in range(RETRY_ATTEMPTS + 1):
+        await RATE_LIMITER.acquire_async()
+        try:
+            response = await client.post(url, json=payload)
+        except httpx.TransportError as e:
+            if attempt == RETRY_ATTEMPTS or (
+                isinstance(e, httpx.TimeoutException) and not retry_timeouts
+            ):
+                raise
+            delay = retry_delay(attempt)
+            reason = type(e).__name__
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt == RETRY_ATTEMPTS:
+                response.raise_for_status()
+                return response
+            delay = retry_delay(attempt, response)
+            reason = response.status_code
+            if response.status_code == 429:
+                RATE_LIMITER.pause(delay)
+
+        log_retry(url, attempt, delay, reason)
+        await asyncio.sleep(delay)
 
 # ------------------------------------------------------------
-# PDF GENERATION
+# REPORT STORAGE
 # ------------------------------------------------------------
-def generate_pdf(controls):
-    buffer = BytesIO()
-    c = canvas.Canvas(buffer, pagesize=LETTER)
-
-    width, height = LETTER
-    x_margin = 40
-    y_margin = 40
-    y = height - y_margin
-    line_height = 14
-
-    def draw(text):
-        nonlocal y
-        for line in textwrap.wrap(text, 100):
-            if y <= y_margin:
-                c.showPage()
-                c.setFont("Helvetica", 10)
-                y = height - y_margin
-            c.drawString(x_margin, y, line)
-            y -= line_height
-
-    controls.sort(key=identifier_key)
-
-    # Company name
-    company_name = "Unknown Company"
-    for item in controls:
-        control = item.get("control") or {}
-        if control.get("orgGroupName"):
-            company_name = control["orgGroupName"]
-            break
-        primary = item.get("primaryEntity") or {}
-        if primary.get("name"):
-            company_name = primary["name"]
-            break
+_container = None
+
+
+def get_container():
+    global _container
+    if _container is None:
+        from azure.storage.blob import BlobServiceClient
+
+        service = BlobServiceClient.from_connection_string(REPORTS_STORAGE_CONNECTION)
+        _container = service.get_container_client(REPORTS_CONTAINER)
+        if not _container.exists():
+            _container.create_container()
+    return _container
+
+
+def store_blob(name, data):
+    if REPORTS_DIR:
+        path = os.path.join(REPORTS_DIR, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        return
+    get_container().upload_blob(name, data, overwrite=True)
+
+
+def read_blob(name):
+    if REPORTS_DIR:
+        try:
+            with open(os.path.join(REPORTS_DIR, name), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
 
-    # Average score
-    values = []
-    for item in controls:
-        v = get_attribute_value(item, "AttributeFormulaValue.value1_2")
+    from azure.core.exceptions import ResourceNotFoundError
+
+    try:
+        return get_container().download_blob(name).readall()
+    except ResourceNotFoundError:
+        return None
+
+
+def delete_blob(name):
+    if REPORTS_DIR:
         try:
-            values.append(float(v))
-        except ValueError:
+            os.remove(os.path.join(REPORTS_DIR, name))
+        except FileNotFoundError:
             pass
+        return
+    from azure.core.exceptions import ResourceNotFoundError
+    try:
+        get_container().delete_blob(name)
+    except ResourceNotFoundError:
+        pass
 
-    avg = sum(values) / len(values) if values else None
 
-    c.setFont("Helvetica-Bold", 14)
-    draw(f"OneTrust Controls Summary - {company_name}")
-    draw("")
+_UNSAFE_NAME_CHARACTERS = re.compile(r"[^A-Za-z0-9._-]")
 
-    c.setFont("Helvetica-Bold", 12)
-    draw(
-        f"Average Score of Applicable Controls: {avg:.2f}"
-        if avg is not None
-        else "Average Score of Applicable Controls: N/A"
+
+def safe_name(value):
+    # Org ids come from callers; keep them from adding path segments to
+    # blob, file and zip entry names.
+    return _UNSAFE_NAME_CHARACTERS.sub("_", value).lstrip(".") or "_"
+
+
+def report_blob_name(org_id, report_id):
+    return f"{safe_name(org_id)}/{report_id}.pdf"
+
+
+def report_error_blob_name(org_id, report_id):
+    return f"{safe_name(org_id)}/{report_id}.error"
+
+
+class BlobCache:
+    # Same interface as DiskCache, on top of report storage.
+    def __init__(self, prefix, ttl):
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def _name(self, key):
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return f"{self.prefix}/{digest}.json"
+
+    def get_entry(self, key):
+        body = read_blob(self._name(key))
+        if body is None:
+            return None
+        entry = json.loads(body)
+        if entry["expires"] < time.time():
+            self.delete(key)
+            return None
+        return entry["expires"], entry["value"]
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        return None if entry is None else entry[1]
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        store_blob(
+            self._name(key),
+            json.dumps({"expires": expires, "value": value}).encode("utf-8")
+        )
+
+    def delete(self, key):
+        try:
+            delete_blob(self._name(key))
+        except Exception:
+            # Already gone (or never written).
+            pass
+
+
+CHECKPOINTS = {
+    "none": lambda: None,
+    "disk": lambda: DiskCache(os.path.join(CACHE_DIR, "checkpoints"), CHECKPOINT_TTL),
+    "blob": lambda: BlobCache("checkpoints", CHECKPOINT_TTL)
+}[CHECKPOINT_BACKEND]()
+
+# ------------------------------------------------------------
+# PAGE SIZE NEGOTIATION
+# ------------------------------------------------------------
+# Best page size that worked for each org on this instance.
+_page_sizes = MemoryCache(4096, PAGE_SIZE_MEMORY_TTL)
+
+
+def page_size_candidates(org_id):
+    size = _page_sizes.get(org_id) or PAGE_SIZE_MAX
+    while True:
+        yield size
+        if size <= PAGE_SIZE_MIN:
+            return
+        size = max(PAGE_SIZE_MIN, size // 2)
+
+
+def page_size_rejected(e):
+    if isinstance(e, (requests.Timeout, httpx.TimeoutException)):
+        return True
+    response = getattr(e, "response", None)
+    return response is not None and response.status_code in PAGE_SIZE_REJECTED
+
+
+def log_page_size_step_down(org_id, size, e):
+    logging.warning(
+        "Page size %s rejected for org %s (%s), stepping down",
+        size, org_id, e
+    )
+
+# ------------------------------------------------------------
+# CONTROL RECORDS
+# ------------------------------------------------------------
+# Each implementation is projected onto the handful of fields the report
+# uses as soon as its page is decoded; the raw JSON is not kept.
+class Control:
+    FIELDS = (
+        "id",
+        "identifier",
+        "name",
+        "description",
+        "org_group_name",
+        "entity_name",
+        "attributes",
+        "effectiveness"
     )
-    draw("")
+    __slots__ = FIELDS + ("sort_key",)
+
+    # attributes holds one value per ATTRIBUTE_KEYS entry, in order.
+    def __init__(self, id, identifier, name, description, org_group_name,
+                 entity_name, attributes, effectiveness):
+        self.id = id
+        self.identifier = identifier
+        self.name = name
+        self.description = description
+        self.org_group_name = org_group_name
+        self.entity_name = entity_name
+        self.attributes = tuple(attributes)
+        self.effectiveness = effectiveness
+        self.sort_key = identifier_sort_key(identifier)
 
-    c.setFont("Helvetica", 10)
+    @property
+    def value(self):
+        return self.attributes[SCORE_INDEX]
 
-    # Controls
-    for item in controls:
+    @classmethod
+    def from_item(cls, item):
         control = item.get("control") or {}
+        return cls(
+            item.get("id"),
+            control.get("identifier", "N/A"),
+            control.get("name", "N/A"),
+            control.get("description", "N/A"),
+            control.get("orgGroupName"),
+            (item.get("primaryEntity") or {}).get("name"),
+            [get_attribute_value(item, key) for key in ATTRIBUTE_KEYS],
+            (item.get("effectivenessInfo") or {}).get("name", "N/A")
+        )
 
-        identifier = control.get("identifier", "N/A")
-        name = control.get("name", "N/A")
-        description = control.get("description", "N/A")
+    @classmethod
+    def from_struct(cls, item):
+        # Same projection as from_item, over the typed msgspec page.
+        control = item.control
+        attributes = item.attributes or {}
+        return cls(
+            item.id,
+            control.identifier if control else "N/A",
+            control.name if control else "N/A",
+            control.description if control else "N/A",
+            control.orgGroupName if control else None,
+            item.primaryEntity.name if item.primaryEntity else None,
+            [struct_attribute_value(attributes, key) for key in ATTRIBUTE_KEYS],
+            item.effectivenessInfo.name if item.effectivenessInfo else "N/A"
+        )
 
-        value = get_attribute_value(item, "AttributeFormulaValue.value1_2")
-        effectiveness = (item.get("effectivenessInfo") or {}).get("name", "N/A")
+    def to_list(self):
+        return [getattr(self, field) for field in self.FIELDS]
 
-        draw(f"Identifier    : {identifier}")
-        draw(f"Name          : {name}")
-        draw(f"Description   : {description}")
-        draw(f"Value         : {value}")
-        draw(f"Effectiveness : {effectiveness}")
-        draw("-" * 90)
 
-    c.save()
-    buffer.seek(0)
-    return buffer
+ControlPage = namedtuple("ControlPage", ["controls", "total_pages"])
+
 
 # ------------------------------------------------------------
-# HTTP TRIGGER
+# PAGE DECODING
 # ------------------------------------------------------------
-@app.route(route="report/{org_id}", auth_level=func.AuthLevel.FUNCTION)
-def report(req: func.HttpRequest) -> func.HttpResponse:
-    org_id = req.route_params.get("org_id")
+# With msgspec installed, pages are decoded straight into typed structs
+# that only declare the fields the report reads; everything else in the
+# payload is skipped without being materialised.
+if msgspec is not None:
+    class _ControlInfo(msgspec.Struct):
+        identifier: Any = "N/A"
+        name: Any = "N/A"
+        description: Any = "N/A"
+        orgGroupName: Any = None
 
-    try:
-        controls = fetch_controls(org_id)
-        pdf = generate_pdf(controls)
+    class _Entity(msgspec.Struct):
+        name: Any = None
 
-        return func.HttpResponse(
-            pdf.read(),
-            mimetype="application/pdf",
-            headers={
-                "Content-Disposition": f'attachment; filename="controls_{org_id}.pdf"'
+    class _Effectiveness(msgspec.Struct):
+        name: Any = "N/A"
+
+    class _Implementation(msgspec.Struct):
+        id: Any = None
+        control: Optional[_ControlInfo] = None
+        primaryEntity: Optional[_Entity] = None
+        effectivenessInfo: Optional[_Effectiveness] = None
+        # Left raw: only the ATTRIBUTE_KEYS entries are decoded, so other
+        # attributes can have any shape.
+        attributes: Optional[dict[str, msgspec.Raw]] = None
+
+    class _Page(msgspec.Struct):
+        content: Optional[list[_Implementation]] = None
+        totalPages: int = 1
+
+    _page_decoder = msgspec.json.Decoder(_Page)
+
+
+def struct_attribute_value(attributes, key):
+    raw = attributes.get(key)
+    return first_attribute_value(None if raw is None else msgspec.json.decode(raw))
+
+
+def decode_page(content):
+    if msgspec is not None and JSON_DECODER in ("auto", "msgspec"):
+        try:
+            page = _page_decoder.decode(content)
+        except msgspec.ValidationError:
+            # Unexpected shape; the generic path below is more forgiving.
+            logging.warning("Page did not match the typed schema, decoding generically")
+        else:
+            return ControlPage(
+                [Control.from_struct(item) for item in page.content or []],
+                page.totalPages
+            )
+
+    if orjson is not None and JSON_DECODER in ("auto", "msgspec", "orjson"):
+        return parse_page(orjson.loads(content))
+    return parse_page(json.loads(content))
+
+# Stored records are only valid for the attribute list they were built
+# with, so persisted cache keys include it.
+ATTRIBUTES_SIGNATURE = hashlib.sha256(
+    "\n".join(ATTRIBUTE_KEYS).encode("utf-8")
+).hexdigest()[:12]
+
+
+def parse_page(data):
+    return ControlPage(
+        [Control.from_item(item) for item in data.get("content", [])],
+        data.get("totalPages", 1)
+    )
+
+
+def dump_controls(controls):
+    return [control.to_list() for control in controls]
+
+
+def load_controls(values):
+    return [Control(*value) for value in values]
+
+# ------------------------------------------------------------
+# FETCH CONTROLS (WITH PAGINATION)
+# ------------------------------------------------------------
+def build_payload(org_id, modified_since=None):
+    filters = [
+        {
+            "field": "organizationId",
+            "operator": "EQUAL_TO",
+            "value": org_id
+        }
+    ]
+    if modified_since is not None:
+        filters.append(
+            {
+                "field": MODIFIED_SINCE_FIELD,
+                "operator": "GREATER_THAN",
+                "value": format_timestamp(modified_since)
             }
         )
+    return {"filters": filters}
 
-    except Exception as e:
-        logging.exception("Failed to generate report")
-        return func.HttpResponse(
-            f"Error generating report: {str(e)}",
-            status_code=500
+
+def page_url(page, size):
+    url = f"{BASE_URL}?page={page}&size={size}"
+    if SERVER_SORT:
+        url += f"&sort={SERVER_SORT}"
+    return url
+
+
+def fetch_page(org_id, page, size, modified_since=None, retry_timeouts=True):
+    response = post_with_retries(
+        page_url(page, size),
+        build_payload(org_id, modified_since),
+        retry_timeouts
+    )
+
+    return decode_page(response.content)
+
+
+def fetch_first_page(org_id, modified_since=None):
+    for size in page_size_candidates(org_id):
+        try:
+            # A timeout at a size we can still step down from is a
+            # page-size signal, not something to retry.
+            data = fetch_page(
+                org_id, 0, size, modified_since,
+                retry_timeouts=size <= PAGE_SIZE_MIN
+            )
+        except (requests.HTTPError, requests.Timeout) as e:
+            if size <= PAGE_SIZE_MIN or not page_size_rejected(e):
+                raise
+            log_page_size_step_down(org_id, size, e)
+            continue
+        _page_sizes.set(org_id, size)
+        return size, data
+
+
+def iter_pages(org_id, modified_since=None, resume=True):
+    # First page tells us how many pages there are; the rest are
+    # fetched concurrently, at most FETCH_WORKERS ahead of the consumer,
+    # and yielded in page order. A checkpoint left by an interrupted
+    # fetch supplies the page size, page count and pages already done.
+    checkpoint, resumed = open_checkpoint(org_id, modified_since, resume)
+    if resumed:
+        size, total_pages = resumed["size"], resumed["total_pages"]
+        logging.info("Resuming fetch for org %s from checkpoint", org_id)
+    else:
+        size, first = fetch_first_page(org_id, modified_since)
+        total_pages = first.total_pages
+        if total_pages <= 1:
+            yield first
+            return
+        if checkpoint:
+            checkpoint.start(size, total_pages)
+            checkpoint.save_page(0, first)
+
+    def fetch(page):
+        data = checkpoint.load_page(page, total_pages) if resumed else None
+        if data is None:
+            data = fetch_page(org_id, page, size, modified_since)
+            if checkpoint:
+                checkpoint.save_page(page, data)
+        return data
+
+    yield fetch(0) if resumed else first
+
+    workers = max(1, min(FETCH_WORKERS, total_pages - 1))
+    remaining = iter(range(1, total_pages))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # range() goes first: zip would otherwise pull (and lose) one
+        # more page from remaining before noticing range is exhausted.
+        pending = deque(
+            pool.submit(fetch, page)
+            for _, page in zip(range(workers), remaining)
+        )
+        while pending:
+            data = pending.popleft().result()
+            page = next(remaining, None)
+            if page is not None:
+                pending.append(pool.submit(fetch, page))
+            yield data
+
+    if checkpoint:
+        checkpoint.clear(total_pages)
+
+
+def iter_controls(org_id, modified_since=None, resume=True):
+    for data in iter_pages(org_id, modified_since, resume):
+        yield from data.controls
+
+
+def iter_sorted_controls(org_id, resume=True):
+    # Each page is sorted on its own (close to free when SERVER_SORT
+    # already ordered it) and the pages are then k-way merged, so no
+    # org-wide sort is needed. Every page is held until the merge starts.
+    pages = [
+        sorted(data.controls, key=identifier_key)
+        for data in iter_pages(org_id, resume=resume)
+    ]
+    yield from heapq.merge(*pages, key=identifier_key)
+
+
+def stream_controls(org_id, refresh=False):
+    cached = None if refresh else get_cached_controls(org_id)
+    if cached:
+        return sorted(cached, key=identifier_key) if STREAM_SORTED else cached
+    if STREAM_SORTED:
+        return iter_sorted_controls(org_id, resume=not refresh)
+    return iter_controls(org_id, resume=not refresh)
+
+
+def fetch_controls(org_id, refresh=False, ttl=None):
+    if not refresh:
+        cached = get_cached_controls(org_id)
+        if cached is not None:
+            return cached
+
+    if INCREMENTAL_SYNC:
+        snapshot, since, started = start_sync(org_id)
+        controls = finish_sync(
+            org_id, snapshot, iter_controls(org_id, since, not refresh), started
+        )
+    else:
+        controls = list(iter_controls(org_id, resume=not refresh))
+    cache_controls(org_id, controls, ttl)
+    return controls
+
+# ------------------------------------------------------------
+# FETCH CONTROLS (ASYNC)
+# ------------------------------------------------------------
+async def fetch_page_async(client, org_id, page, size, modified_since=None,
+                           retry_timeouts=True):
+    response = await post_with_retries_async(
+        client,
+        page_url(page, size),
+        build_payload(org_id, modified_since),
+        retry_timeouts
+    )
+
+    return decode_page(response.content)
+
+
+async def fetch_first_page_async(client, org_id, modified_since=None):
+    for size in page_size_candidates(org_id):
+        try:
+            data = await fetch_page_async(
+                client, org_id, 0, size, modified_since,
+                retry_timeouts=size <= PAGE_SIZE_MIN
+            )
+        except (httpx.HTTPStatusError, httpx.TimeoutException) as e:
+            if size <= PAGE_SIZE_MIN or not page_size_rejected(e):
+                raise
+            log_page_size_step_down(org_id, size, e)
+            continue
+        _page_sizes.set(org_id, size)
+        return size, data
+
+
+async def fetch_all_controls_async(org_id, modified_since=None, resume=True):
+    # Checkpoint reads and writes are blocking disk or blob calls, so
+    # they run in threads rather than on the event loop.
+    client = get_async_client()
+    checkpoint, resumed = await asyncio.to_thread(
+        open_checkpoint, org_id, modified_since, resume
+    )
+    if resumed:
+        size, total_pages = resumed["size"], resumed["total_pages"]
+        logging.info("Resuming fetch for org %s from checkpoint", org_id)
+    else:
+        size, first = await fetch_first_page_async(client, org_id, modified_since)
+        total_pages = first.total_pages
+        if total_pages <= 1:
+            return list(first.controls)
+        if checkpoint:
+            await asyncio.to_thread(checkpoint.start, size, total_pages)
+            await asyncio.to_thread(checkpoint.save_page, 0, first)
+
+    semaphore = asyncio.Semaphore(max(1, FETCH_WORKERS))
+
+    async def bounded(page):
+        if resumed:
+            data = await asyncio.to_thread(checkpoint.load_page, page, total_pages)
+            if data is not None:
+                return data
+        async with semaphore:
+            data = await fetch_page_async(
+                client, org_id, page, size, modified_since
+            )
+        if checkpoint:
+            await asyncio.to_thread(checkpoint.save_page, page, data)
+        return data
+
+    pages = [] if resumed else [first]
+    # Every page finishes (and is checkpointed) before a failure is
+    # raised, so a retry resumes with as little refetching as possible.
+    pages.extend(await asyncio.gather(
+        *(bounded(page) for page in range(0 if resumed else 1, total_pages)),
+        return_exceptions=checkpoint is not None
+    ))
+    for data in pages:
+        if isinstance(data, BaseException):
+            raise data
+    controls = []
+    for data in pages:
+        controls.extend(data.controls)
+
+    if checkpoint:
+        await asyncio.to_thread(checkpoint.clear, total_pages)
+    return controls
+
+
+async def fetch_controls_async(org_id, refresh=False):
+    # The controls cache and the sync snapshot may be on disk, and each
+    # read or write (de)serialises the whole org, so they run in threads.
+    if not refresh:
+        cached = await asyncio.to_thread(get_cached_controls, org_id)
+        if cached is not None:
+            return cached
+
+    if INCREMENTAL_SYNC:
+        snapshot, since, started = await asyncio.to_thread(start_sync, org_id)
+        changed = await fetch_all_controls_async(org_id, since, not refresh)
+        controls = await asyncio.to_thread(
+            finish_sync, org_id, snapshot, changed, started
+        )
+    else:
+        controls = await fetch_all_controls_async(org_id, resume=not refresh)
+    await asyncio.to_thread(cache_controls, org_id, controls)
+    return controls
+
+# ------------------------------------------------------------
+# CONTROLS CACHE
+# ------------------------------------------------------------
+def controls_cache_key(org_id):
+    return f"controls:{ATTRIBUTES_SIGNATURE}:{org_id}"
+
+
+def get_cached_controls(org_id):
+    if CONTROLS_CACHE is None:
+        return None
+    return CONTROLS_CACHE.get(controls_cache_key(org_id))
+
+
+def cache_controls(org_id, controls, ttl=None):
+    # ttl can only lengthen the org's configured lifetime.
+    if CONTROLS_CACHE is None:
+        return
+    org_ttl = CONTROLS_CACHE_TTLS.get(org_id, CONTROLS_CACHE_TTL)
+    CONTROLS_CACHE.set(controls_cache_key(org_id), controls, max(org_ttl, ttl or 0))
+
+
+def invalidate_controls(org_id):
+    if CONTROLS_CACHE is not None:
+        CONTROLS_CACHE.delete(controls_cache_key(org_id))
+    if INCREMENTAL_SYNC:
+        invalidate_snapshot(org_id)
+
+# ------------------------------------------------------------
+# SORT IDENTIFIERS (NATURAL ORDER)
+# ------------------------------------------------------------
+_IDENTIFIER_TOKENS = re.compile(r"(\d+)")
+
+
+@lru_cache(maxsize=65536)
+def identifier_sort_key(identifier):
+    # "A.10b" -> (((1, "A"),), ((0, 10), (1, "b"))): dot-separated
+    # segments, numbers compared numerically and ahead of text. The raw
+    # identifier breaks remaining ties ("01" vs "1"). The split puts the
+    # digit runs at odd indexes; str.isdigit() would also accept "²".
+    identifier = identifier if isinstance(identifier, str) else ""
+    segments = tuple(
+        tuple(
+            (0, int(token)) if i % 2 else (1, token)
+            for i, token in enumerate(_IDENTIFIER_TOKENS.split(segment))
+            if token
         )
+        for segment in identifier.split(".")
+    )
+    return segments, identifier
+
+
+# Keys are computed once per record at parse time.
+identifier_key = attrgetter("sort_key")
+
+# ------------------------------------------------------------
+# ATTRIBUTE HELPER
+# ------------------------------------------------------------
+def get_attribute_value(item, key):
+    attrs = item.get("attributes") or {}
+    return first_attribute_value(attrs.get(key))
+
+
+def first_attribute_value(values):
+    if not values:
+        return "N/A"
+
+    val = values[0].get("value")
+    if val in (None, "0", 0):
+        return "N/A"
+
+    return val
+
+
+def parse_score(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        # Junk, or a dict/list attribute value.
+        return None
+
+# ------------------------------------------------------------
+# SCORE STATISTICS (COLUMNAR)
+# ------------------------------------------------------------
+ControlTable = namedtuple("ControlTable", ["scores", "effectiveness"])
+
+
+def object_array(values):
+    # One element per value, even when the values are lists themselves
+    # (np.array would turn equal-length lists into a second dimension).
+    return np.fromiter(values, dtype=object, count=len(values))
+
+
+def to_score_array(values):
+    # NaN marks controls without a usable score. The whole column is
+    # converted in one go; only a column with junk in it falls back to
+    # parsing value by value.
+    raw = object_array(values)
+    scores = np.full(len(raw), np.nan)
+    present = raw != "N/A"
+    try:
+        scores[present] = raw[present].astype(np.float64)
+    except (TypeError, ValueError):
+        scores[present] = [
+            np.nan if score is None else score
+            for score in map(parse_score, raw[present])
+        ]
+    # "Infinity" and "NaN" parse as floats but are no more usable than junk.
+    scores[~np.isfinite(scores)] = np.nan
+    return scores
+
+
+def score_stats(table, bins=10):
+    valid = ~np.isnan(table.scores)
+    scores = table.scores[valid]
+    if not scores.size:
+        return {"count": 0, "mean": None, "median": None, "min": None,
+                "max": None, "histogram": None, "by_effectiveness": {}}
+
+    counts, edges = np.histogram(scores, bins=bins)
+    names, inverse = np.unique(table.effectiveness[valid], return_inverse=True)
+    group_counts = np.bincount(inverse)
+    group_sums = np.bincount(inverse, weights=scores)
+
+    return {
+        "count": int(scores.size),
+        "mean": float(scores.mean()),
+        "median": float(np.median(scores)),
+        "min": float(scores.min()),
+        "max": float(scores.max()),
+        "histogram": {"counts": counts.tolist(), "edges": edges.tolist()},
+        "by_effectiveness": {
+            name: {"count": int(count), "mean": float(total / count)}
+            for name, count, total in zip(names, group_counts, group_sums)
+        }
+    }
+
+# ------------------------------------------------------------
+# COMPANY NAME
+# ------------------------------------------------------------
+def get_company_name(control):
+    return control.org_group_name or control.entity_name
+
+
+def find_company_name(controls):
+    for control in controls:
+        name = get_company_name(control)
+        if name:
+            return name
+    return "Unknown Company"
+
+
+def peek_company_name(controls):
+    # Consumes only as many items as needed to find a name and hands
+    # back an iterator that still yields them.
+    controls = iter(controls)
+    head = []
+    for control in controls:
+        head.append(control)
+        if get_company_name(control):
+            break
+    return chain(head, controls), find_company_name(head)
+
+# ------------------------------------------------------------
+# REPORT MODEL
+# ------------------------------------------------------------
+ReportRow = namedtuple(
+    "ReportRow", ["identifier", "name", "description", "effectiveness"]
+)
+# attributes is the attribute index: attribute key -> one value per
+# row, in row order. Renderers and stats read attribute values from it.
+ReportModel = namedtuple(
+    "ReportModel", ["company_name", "stats", "attributes", "rows"]
+)
+
+
+class ReportModelBuilder:
+    # Collects everything the renderer needs in a single pass over the
+    # controls: company name, the attribute index, the effectiveness
+    # column and display rows. In stream mode the renderer reads
+    # columns while they are still growing.
+    def __init__(self):
+        self.company_name = None
+        self.columns = {key: [] for key in ATTRIBUTE_KEYS}
+        self.effectiveness = []
+
+    def add(self, control):
+        if self.company_name is None:
+            self.company_name = get_company_name(control) or None
+        for column, value in zip(self.columns.values(), control.attributes):
+            column.append(value)
+        self.effectiveness.append(str(control.effectiveness or "N/A"))
+        return ReportRow(
+            str(control.identifier),
+            str(control.name),
+            str(control.description),
+            str(control.effectiveness)
+        )
+
+    def attribute_index(self):
+        return {key: object_array(column) for key, column in self.columns.items()}
+
+    def stats(self, attributes=None):
+        attributes = self.attribute_index() if attributes is None else attributes
+        return score_stats(
+            ControlTable(
+                scores=to_score_array(attributes[SCORE_ATTRIBUTE]),
+                effectiveness=object_array(self.effectiveness)
+            )
+        )
+
+
+def build_report_model(controls):
+    builder = ReportModelBuilder()
+    rows = [builder.add(control) for control in controls]
+    attributes = builder.attribute_index()
+    return ReportModel(
+        builder.company_name or "Unknown Company",
+        builder.stats(attributes),
+        attributes,
+        rows
+    )
+
+# ------------------------------------------------------------
+# PDF GENERATION
+# ------------------------------------------------------------
+PAGE_WIDTH, PAGE_HEIGHT = LETTER
+X_MARGIN = 40
+Y_MARGIN = 40
+LINE_HEIGHT = 14
+# Lines start at the top margin and stop once y reaches the bottom one.
+LINES_PER_PAGE = math.ceil((PAGE_HEIGHT - 2 * Y_MARGIN) / LINE_HEIGHT)
+TEXT_WIDTH = PAGE_WIDTH - 2 * X_MARGIN
+
+TITLE_FONT = ("Helvetica-Bold", 14)
+HEADING_FONT = ("Helvetica-Bold", 12)
+BODY_FONT = ("Helvetica", 10)
+FOOTER_FONT = ("Helvetica", 8)
+
+
+_WRAP_WHITESPACE = re.compile(r"[\t\n\x0b\x0c\r]")
+_WRAP_TOKENS = re.compile(r"\s+|\S+")
+
+
+def split_word(word, font_name, font_size, max_width):
+    # Hard-breaks a word wider than the line, fitting as many characters
+    # per piece as the font metrics allow.
+    pieces = []
+    while stringWidth(word, font_name, font_size) > max_width:
+        cut = 1
+        while cut < len(word) and stringWidth(word[:cut + 1], font_name, font_size) <= max_width:
+            cut += 1
+        pieces.append(word[:cut])
+        word = word[cut:]
+    return pieces, word
+
+
+def wrap_line(text, font_name, font_size, max_width=TEXT_WIDTH):
+    # Labels, separators, names and most descriptions repeat across rows
+    # and orgs and are wrapped once. Longer text is mostly unique, and
+    # caching it would only pin it (twice: key and lines) in memory.
+    if len(text) <= WRAP_CACHE_MAX_CHARS:
+        return wrap_line_cached(text, font_name, font_size, max_width)
+    return wrap_text(text, font_name, font_size, max_width)
+
+
+def wrap_text(text, font_name, font_size, max_width):
+    # Greedy word wrap on rendered width. Like textwrap, blank text
+    # yields no lines.
+    text = _WRAP_WHITESPACE.sub(" ", text)
+    if not text.strip():
+        return ()
+    if stringWidth(text, font_name, font_size) <= max_width:
+        return (text.rstrip(),)
+
+    lines = []
+    line = ""
+    line_width = 0.0
+    for token in _WRAP_TOKENS.findall(text):
+        token_width = stringWidth(token, font_name, font_size)
+        if line_width + token_width <= max_width:
+            line += token
+            line_width += token_width
+            continue
+        if line.strip():
+            lines.append(line.rstrip())
+        line, line_width = "", 0.0
+        if token.isspace():
+            continue
+        pieces, token = split_word(token, font_name, font_size, max_width)
+        lines.extend(pieces)
+        line = token
+        line_width = stringWidth(token, font_name, font_size)
+    if line.strip():
+        lines.append(line.rstrip())
+    return tuple(lines)
+
+
+wrap_line_cached = lru_cache(maxsize=WRAP_CACHE_SIZE)(wrap_text)
+
+
+def average_lines(avg):
+    yield HEADING_FONT
+    yield (
+        f"Average Score of Applicable Controls: {avg:.2f}"
+        if avg is not None
+        else "Average Score of Applicable Controls: N/A"
+    )
+    yield ""
+
+
+def report_lines(company_name, rows, attributes, stats=None, final_stats=None):
+    # Font changes (tuples) and text lines, in drawing order. Attribute
+    # values come from the attribute index by row position. final_stats
+    # is called after the last row, for stream mode.
+    yield TITLE_FONT
+    yield f"OneTrust Controls Summary - {company_name}"
+    yield ""
+
+    if stats is not None:
+        yield from average_lines(stats["mean"])
+
+    yield BODY_FONT
+
+    columns = [attributes[key] for key in ATTRIBUTE_KEYS]
+    for i, row in enumerate(rows):
+        yield f"Identifier    : {row.identifier}"
+        yield f"Name          : {row.name}"
+        yield f"Description   : {row.description}"
+        for label, column in zip(ATTRIBUTE_LABELS, columns):
+            yield f"{label:<14}: {column[i]}"
+        yield f"Effectiveness : {row.effectiveness}"
+        yield "-" * 90
+
+    if final_stats is not None:
+        yield from average_lines(final_stats()["mean"])
+
+
+def paginate(lines):
+    # Wraps text and splits it into pages of (font, line) pairs. The
+    # layout is fixed-pitch, so pages can be painted independently.
+    font = BODY_FONT
+    page = []
+    for item in lines:
+        if isinstance(item, tuple):
+            font = item
+            continue
+        for line in wrap_line(item, *font):
+            if len(page) == LINES_PER_PAGE:
+                yield page
+                page = []
+                font = BODY_FONT
+            page.append((font, line))
+    if page:
+        yield page
+
+
+def paint_pages(pages, out, first_page=1):
+    c = canvas.Canvas(out, pagesize=LETTER)
+    for number, page in enumerate(pages, first_page):
+        current = None
+        y = PAGE_HEIGHT - Y_MARGIN
+        for font, line in page:
+            if font != current:
+                c.setFont(*font)
+                current = font
+            c.drawString(X_MARGIN, y, line)
+            y -= LINE_HEIGHT
+        c.setFont(*FOOTER_FONT)
+        c.drawCentredString(PAGE_WIDTH / 2, Y_MARGIN / 2, f"Page {number}")
+        c.showPage()
+    c.save()
+
+
+def paint_fragment(pages, first_page):
+    buffer = BytesIO()
+    paint_pages(pages, buffer, first_page)
+    return buffer.getvalue()
+
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+_render_slots = threading.BoundedSemaphore(max(1, RENDER_PARALLEL_JOBS))
+
+
+def get_render_pool():
+    # Created on first use and kept for the life of the worker. Workers
+    # start from a fresh interpreter (forkserver, or spawn where that is
+    # unavailable) instead of forking the threaded Functions worker.
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context(
+                "forkserver" if "forkserver" in methods else "spawn"
+            )
+            _render_pool = ProcessPoolExecutor(
+                max_workers=RENDER_PROCESSES, mp_context=context
+            )
+        return _render_pool
+
+
+def discard_render_pool(pool):
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is pool:
+            _render_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def paint_pages_parallel(pages, out):
+    # Chunks carry their starting page number, so numbering matches a
+    # serial render; fragments are concatenated in order.
+    starts = range(0, len(pages), RENDER_CHUNK_PAGES)
+    chunks = [pages[start:start + RENDER_CHUNK_PAGES] for start in starts]
+    pool = get_render_pool()
+    try:
+        fragments = list(
+            pool.map(paint_fragment, chunks, [start + 1 for start in starts])
+        )
+    except BrokenProcessPool:
+        # A worker died; the next render starts a new pool.
+        logging.warning("Render pool is broken, painting serially")
+        discard_render_pool(pool)
+        paint_pages(pages, out)
+        return
+
+    writer = PdfWriter()
+    for fragment in fragments:
+        writer.append(PdfReader(BytesIO(fragment)))
+    writer.write(out)
+
+
+def paint_report_pages(pages, out):
+    if (
+        RENDER_PROCESSES > 1
+        and len(pages) >= RENDER_PARALLEL_MIN_PAGES
+        and _render_slots.acquire(blocking=False)
+    ):
+        try:
+            paint_pages_parallel(pages, out)
+        finally:
+            _render_slots.release()
+    else:
+        paint_pages(pages, out)
+
+
+# ------------------------------------------------------------
+# TABLE LAYOUT
+# ------------------------------------------------------------
+TABLE_TITLE_STYLE = ParagraphStyle("TableTitle", fontName=TITLE_FONT[0], fontSize=TITLE_FONT[1], leading=18)
+TABLE_HEADING_STYLE = ParagraphStyle("TableHeading", fontName=HEADING_FONT[0], fontSize=HEADING_FONT[1], leading=16)
+TABLE_FONT = ("Helvetica", 8)
+TABLE_HEADER_FONT = ("Helvetica-Bold", 8)
+TABLE_CELL_PADDING = 3
+TABLE_MIN_DESCRIPTION_WIDTH = 120
+TABLE_MIN_ATTRIBUTE_WIDTH = 24
+TABLE_STYLE = TableStyle([
+    ("FONT", (0, 0), (-1, 0), *TABLE_HEADER_FONT, 10),
+    ("FONT", (0, 1), (-1, -1), *TABLE_FONT, 10),
+    ("BACKGROUND", (0, 0), (-1, 0), colors.lightgrey),
+    ("ROWBACKGROUNDS", (0, 1), (-1, -1), [colors.white, colors.whitesmoke]),
+    ("GRID", (0, 0), (-1, -1), 0.25, colors.grey),
+    ("VALIGN", (0, 0), (-1, -1), "TOP"),
+    ("LEFTPADDING", (0, 0), (-1, -1), TABLE_CELL_PADDING),
+    ("RIGHTPADDING", (0, 0), (-1, -1), TABLE_CELL_PADDING),
+    ("TOPPADDING", (0, 0), (-1, -1), 2),
+    ("BOTTOMPADDING", (0, 0), (-1, -1), 2),
+])
+
+
+def table_column_widths():
+    # Attribute columns narrow before the description goes below its
+    # minimum; past TABLE_MIN_ATTRIBUTE_WIDTH the table cannot fit.
+    identifier, name, effectiveness = 50, 110, 70
+    count = len(ATTRIBUTE_LABELS)
+    spare = TEXT_WIDTH - identifier - name - effectiveness - TABLE_MIN_DESCRIPTION_WIDTH
+    attribute = min(45, spare / count)
+    if attribute < TABLE_MIN_ATTRIBUTE_WIDTH:
+        raise ValueError(
+            f"The table layout cannot fit {count} attribute columns on the page; "
+            "use the lines layout or fewer REPORT_ATTRIBUTES"
+        )
+    description = TEXT_WIDTH - identifier - name - effectiveness - attribute * count
+    return [identifier, name, description] + [attribute] * count + [effectiveness]
+
+
+def wrap_cell(value, font, width):
+    return "\n".join(wrap_line(value, *font, width - 2 * TABLE_CELL_PADDING))
+
+
+def table_row(row, attributes, widths):
+    # Cells are pre-wrapped with the memoized wrap_line and passed as
+    # plain multi-line strings, which the table draws far faster than
+    # Paragraph flowables.
+    values = [row.identifier, row.name, row.description, *attributes, row.effectiveness]
+    return [wrap_cell(value, TABLE_FONT, width) for value, width in zip(values, widths)]
+
+
+def draw_page_number(c, doc):
+    c.saveState()
+    c.setFont(*FOOTER_FONT)
+    c.drawCentredString(PAGE_WIDTH / 2, Y_MARGIN / 2, f"Page {doc.page}")
+    c.restoreState()
+
+
+def generate_table_pdf(model, out):
+    # One table row per control; LongTable handles page breaks, repeats
+    # the header row on every page and splits rows taller than a page.
+    avg = model.stats["mean"]
+    widths = table_column_widths()
+    header = [
+        wrap_cell(label, TABLE_HEADER_FONT, width)
+        for label, width in zip(
+            ["Identifier", "Name", "Description", *ATTRIBUTE_LABELS, "Effectiveness"],
+            widths
+        )
+    ]
+    columns = [model.attributes[key] for key in ATTRIBUTE_KEYS]
+    table = LongTable(
+        [header] + [
+            table_row(row, [str(column[i]) for column in columns], widths)
+            for i, row in enumerate(model.rows)
+        ],
+        colWidths=widths,
+        repeatRows=1,
+        splitInRow=1
+    )
+    table.setStyle(TABLE_STYLE)
+
+    story = [
+        Paragraph(escape(f"OneTrust Controls Summary - {model.company_name}"), TABLE_TITLE_STYLE),
+        Paragraph(
+            f"Average Score of Applicable Controls: {avg:.2f}"
+            if avg is not None
+            else "Average Score of Applicable Controls: N/A",
+            TABLE_HEADING_STYLE
+        ),
+        Spacer(1, 8),
+        table
+    ]
+
+    doc = SimpleDocTemplate(
+        out,
+        pagesize=LETTER,
+        leftMargin=X_MARGIN,
+        rightMargin=X_MARGIN,
+        topMargin=Y_MARGIN,
+        bottomMargin=Y_MARGIN
+    )
+    doc.build(story, onFirstPage=draw_page_number, onLaterPages=draw_page_number)
+
+
+def generate_pdf(controls, stream=False, out=None, layout=REPORT_LAYOUT):
+    buffer = out if out is not None else BytesIO()
+
+    # The table needs every row before it can be laid out, so stream
+    # mode only changes the order (arrival order) there.
+    if layout == "table":
+        if not stream:
+            controls = sorted(controls, key=identifier_key)
+        generate_table_pdf(build_report_model(controls), buffer)
+        buffer.seek(0)
+        return buffer
+
+    # In stream mode rows are built, laid out and painted as controls
+    # arrive and the average is appended once the last one has been seen.
+    if stream:
+        controls, company_name = peek_company_name(controls)
+        builder = ReportModelBuilder()
+        lines = report_lines(
+            company_name,
+            map(builder.add, controls),
+            builder.columns,
+            final_stats=builder.stats
+        )
+        paint_pages(paginate(lines), buffer)
+    else:
+        model = build_report_model(sorted(controls, key=identifier_key))
+        pages = list(paginate(
+            report_lines(model.company_name, model.rows, model.attributes, model.stats)
+        ))
+        paint_report_pages(pages, buffer)
+
+    buffer.seek(0)
+    return buffer
+
+
+def spool_file():
+    # Small PDFs stay in memory, large ones spill to local disk.
+    return tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_MAX_BYTES)
+
+
+def iter_pdf_chunks(pdf, chunk_size=PDF_CHUNK_SIZE):
+    try:
+        while True:
+            chunk = pdf.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        pdf.close()
+
+# ------------------------------------------------------------
+# FETCH CHECKPOINTS
+# ------------------------------------------------------------
+class FetchCheckpoint:
+    # Pages of one org's fetch, keyed by page index. A run is identified
+    # by org, attribute set and incremental watermark; the page size and
+    # page count it settled on are kept in a manifest.
+    def __init__(self, store, org_id, modified_since):
+        self.store = store
+        self.prefix = f"checkpoint:{ATTRIBUTES_SIGNATURE}:{org_id}:{modified_since}"
+
+    def manifest(self):
+        return self.store.get(f"{self.prefix}:manifest")
+
+    def start(self, size, total_pages):
+        self.store.set(
+            f"{self.prefix}:manifest", {"size": size, "total_pages": total_pages}
+        )
+
+    def load_page(self, page, total_pages):
+        values = self.store.get(f"{self.prefix}:{page}")
+        if values is None:
+            return None
+        return ControlPage(load_controls(values), total_pages)
+
+    def save_page(self, page, data):
+        self.store.set(f"{self.prefix}:{page}", dump_controls(data.controls))
+
+    def clear(self, total_pages):
+        for page in range(total_pages):
+            self.store.delete(f"{self.prefix}:{page}")
+        self.store.delete(f"{self.prefix}:manifest")
+
+    def discard(self):
+        manifest = self.manifest()
+        if manifest:
+            self.clear(manifest["total_pages"])
+
+
+def open_checkpoint(org_id, modified_since=None, resume=True):
+    # The checkpoint to write to (None when disabled) and the manifest of
+    # the run to resume, if any. Without resume, pages of an older run
+    # are dropped so they cannot end up mixed into the new one.
+    if CHECKPOINTS is None:
+        return None, None
+    checkpoint = FetchCheckpoint(CHECKPOINTS, org_id, modified_since)
+    if resume:
+        return checkpoint, checkpoint.manifest()
+    checkpoint.discard()
+    return checkpoint, None
+
+# ------------------------------------------------------------
+# INCREMENTAL SYNC
+# ------------------------------------------------------------
+def format_timestamp(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def control_key(control):
+    return control.id or control.identifier
+
+
+def snapshot_key(org_id):
+    return f"snapshot:{ATTRIBUTES_SIGNATURE}:{org_id}"
+
+
+def start_sync(org_id):
+    # Returns the stored snapshot and the watermark to filter on, or no
+    # watermark when a full sync is due (first run or periodic refresh,
+    # which is also how deleted implementations drop out).
+    started = time.time()
+    snapshot = SNAPSHOTS.get(snapshot_key(org_id))
+    if snapshot is None or started - snapshot["full_sync"] > INCREMENTAL_FULL_SYNC_INTERVAL:
+        return None, None, started
+    return snapshot, snapshot["watermark"], started
+
+
+def finish_sync(org_id, snapshot, items, started):
+    if snapshot is None:
+        controls = list(items)
+        full_sync = started
+    else:
+        merged = {control_key(control): control for control in snapshot["controls"]}
+        changed = 0
+        for control in items:
+            merged[control_key(control)] = control
+            changed += 1
+        logging.info("Incremental sync for org %s: %s changed", org_id, changed)
+        controls = list(merged.values())
+        full_sync = snapshot["full_sync"]
+
+    SNAPSHOTS.set(
+        snapshot_key(org_id),
+        {
+            "watermark": started - INCREMENTAL_SKEW,
+            "full_sync": full_sync,
+            "controls": controls
+        }
+    )
+    return controls
+
+
+def invalidate_snapshot(org_id):
+    SNAPSHOTS.delete(snapshot_key(org_id))
+
+# ------------------------------------------------------------
+# RENDERED PDF CACHE
+# ------------------------------------------------------------
+def report_row(control):
+    row = control.to_list()
+    # The implementation id is not drawn.
+    return row[1:]
+
+
+def report_fingerprint(controls):
+    # Only the fields the report draws, in identifier order, so payload
+    # noise and API ordering do not change the hash.
+    rows = sorted(
+        (identifier_key(control), json.dumps(report_row(control), default=str))
+        for control in controls
+    )
+    digest = hashlib.sha256()
+    for _, row in rows:
+        digest.update(row.encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+# Bump when a renderer change alters the PDF drawn from the same data.
+REPORT_RENDER_VERSION = 1
+
+
+def report_etag(controls, layout=REPORT_LAYOUT):
+    # The data fingerprint plus everything else the PDF depends on, so
+    # a new label or score attribute is not answered with a 304.
+    config = json.dumps(
+        [REPORT_RENDER_VERSION, layout, ATTRIBUTE_KEYS, ATTRIBUTE_LABELS, SCORE_ATTRIBUTE]
+    )
+    etag = hashlib.sha256(
+        f"{report_fingerprint(controls)}\n{config}".encode("utf-8")
+    ).hexdigest()
+    if layout != "lines":
+        etag = f"{etag}-{layout}"
+    return etag
+
+
+def render_report(controls, layout=REPORT_LAYOUT, etag=None):
+    # Callers that already checked If-None-Match pass the etag they
+    # computed, so the controls are only hashed once.
+    if etag is None:
+        etag = report_etag(controls, layout)
+    if PDF_CACHE is not None:
+        body = PDF_CACHE.get(etag)
+        if body is not None:
+            return etag, body
+
+    body = generate_pdf(controls, layout=layout).read()
+    if PDF_CACHE is not None:
+        PDF_CACHE.set(etag, body)
+    return etag, body
+
+# ------------------------------------------------------------
+# BATCH REPORTS
+# ------------------------------------------------------------
+def build_report(org_id, refresh=False, ttl=None):
+    try:
+        _, body = render_report(fetch_controls(org_id, refresh=refresh, ttl=ttl))
+        return org_id, body, None
+    except Exception as e:
+        logging.exception("Failed to generate report for org %s", org_id)
+        return org_id, None, str(e)
+
+
+def generate_batch_zip(org_ids):
+    # Orgs share the pooled session; a failed org is recorded in the
+    # manifest instead of failing the whole batch.
+    buffer = BytesIO()
+    manifest = []
+    workers = max(1, min(BATCH_WORKERS, len(org_ids)))
+    with ThreadPoolExecutor(max_workers=workers) as pool, \
+            zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+        for org_id, body, error in pool.map(build_report, org_ids):
+            if error is None:
+                filename = f"controls_{safe_name(org_id)}.pdf"
+                archive.writestr(filename, body)
+                manifest.append({"org_id": org_id, "file": filename})
+            else:
+                manifest.append({"org_id": org_id, "error": error})
+        archive.writestr("manifest.json", json.dumps(manifest, indent=2))
+
+    buffer.seek(0)
+    return buffer
+
+# ------------------------------------------------------------
+# ORCHESTRATED REPORTS (DURABLE FUNCTIONS)
+# ------------------------------------------------------------
+# Pages are fetched by parallel activities and spilled to report
+# storage, so the orchestration history only carries blob names.
+def page_blob_name(run_id, page):
+    return f"runs/{run_id}/page-{page}.json"
+
+
+def store_page(run_id, page, data):
+    name = page_blob_name(run_id, page)
+    store_blob(name, json.dumps(dump_controls(data.controls)).encode("utf-8"))
+    return name
+
+
+@app.orchestration_trigger(context_name="context")
+def report_orchestrator(context: df.DurableOrchestrationContext):
+    org_id = context.get_input()["org_id"]
+    run_id = context.instance_id
+
+    first = yield context.call_activity(
+        "fetch_first_page_activity", {"org_id": org_id, "run_id": run_id}
+    )
+    tasks = [
+        context.call_activity(
+            "fetch_page_activity",
+            {"org_id": org_id, "run_id": run_id, "page": page, "size": first["size"]}
+        )
+        for page in range(1, first["total_pages"])
+    ]
+    pages = [first["blob"]]
+    if tasks:
+        pages.extend((yield context.task_all(tasks)))
+
+    return (yield context.call_activity(
+        "render_report_activity",
+        {"org_id": org_id, "run_id": run_id, "pages": pages}
+    ))
+
+
+@app.activity_trigger(input_name="job")
+def fetch_first_page_activity(job):
+    size, data = fetch_first_page(job["org_id"])
+    return {
+        "size": size,
+        "total_pages": data.total_pages,
+        "blob": store_page(job["run_id"], 0, data)
+    }
+
+
+@app.activity_trigger(input_name="job")
+def fetch_page_activity(job):
+    data = fetch_page(job["org_id"], job["page"], job["size"])
+    return store_page(job["run_id"], job["page"], data)
+
+
+@app.activity_trigger(input_name="job")
+def render_report_activity(job):
+    org_id = job["org_id"]
+    controls = []
+    for name in job["pages"]:
+        controls.extend(load_controls(json.loads(read_blob(name))))
+
+    _, body = render_report(controls)
+    name = report_blob_name(org_id, job["run_id"])
+    store_blob(name, body)
+
+    for page in job["pages"]:
+        delete_blob(page)
+
+    return {
+        "org_id": org_id,
+        "report_id": job["run_id"],
+        "location": f"/api/reports/{org_id}/{job['run_id']}"
+    }
+
+# ------------------------------------------------------------
+# PRE-WARMING
+# ------------------------------------------------------------
+@app.timer_trigger(schedule=PREWARM_SCHEDULE, arg_name="timer", run_on_startup=False)
+def prewarm_reports(timer: func.TimerRequest) -> None:
+    if not PREWARM_ORG_IDS:
+        logging.info("No PREWARM_ORG_IDS configured, skipping pre-warm")
+        return
+
+    # Refresh, and cache with PREWARM_CACHE_TTL so the controls are
+    # still there when the peak arrives.
+    workers = max(1, min(BATCH_WORKERS, len(PREWARM_ORG_IDS)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(
+            lambda org_id: build_report(org_id, refresh=True, ttl=PREWARM_CACHE_TTL),
+            PREWARM_ORG_IDS
+        )
+        failed = [org_id for org_id, _, error in results if error is not None]
+
+    logging.info(
+        "Pre-warmed %s of %s reports",
+        len(PREWARM_ORG_IDS) - len(failed), len(PREWARM_ORG_IDS)
+    )
+    if failed:
+        logging.warning("Pre-warm failed for orgs: %s", ", ".join(failed))
+
+# ------------------------------------------------------------
+# QUEUED REPORTS
+# ------------------------------------------------------------
+@app.queue_trigger(
+    arg_name="msg",
+    queue_name=REPORT_QUEUE,
+    connection=REPORT_QUEUE_CONNECTION
+)
+def report_worker(msg: func.QueueMessage) -> None:
+    job = msg.get_json()
+    org_id = job["org_id"]
+    report_id = job["report_id"]
+    layout = job.get("layout", REPORT_LAYOUT)
+
+    try:
+        _, body = render_report(fetch_controls(org_id), layout)
+    except Exception as e:
+        # Recorded for the download route, then re-raised so the queue
+        # retries the job and finally moves it to the poison queue.
+        store_blob(
+            report_error_blob_name(org_id, report_id),
+            json.dumps(
+                {"org_id": org_id, "report_id": report_id, "error": str(e)}
+            ).encode("utf-8")
+        )
+        raise
+
+    store_blob(report_blob_name(org_id, report_id), body)
+    logging.info("Stored queued report %s for org %s", report_id, org_id)
+    delete_blob(report_error_blob_name(org_id, report_id))
+
+
+def report_job(org_id, layout=REPORT_LAYOUT):
+    # The queue message for one report, and what the client is told.
+    report_id = uuid.uuid4().hex
+    message = json.dumps({"org_id": org_id, "report_id": report_id, "layout": layout})
+    location = f"/api/reports/{quote(org_id, safe='')}/{report_id}"
+    return message, {"org_id": org_id, "report_id": report_id, "location": location}
+
+
+def enqueue_report(org_id, jobs, layout=REPORT_LAYOUT):
+    message, job = report_job(org_id, layout)
+    jobs.set(message)
+    return func.HttpResponse(
+        json.dumps(job),
+        status_code=202,
+        mimetype="application/json",
+        headers={"Location": job["location"]}
+    )
+
+
+def enqueue_batch(org_ids, jobs):
+    queued = [report_job(org_id) for org_id in org_ids]
+    jobs.set([message for message, _ in queued])
+    return func.HttpResponse(
+        json.dumps({"reports": [job for _, job in queued]}, indent=2),
+        status_code=202,
+        mimetype="application/json"
+    )
+
+# ------------------------------------------------------------
+# HTTP TRIGGER
+# ------------------------------------------------------------
+@app.route(route="report/{org_id}", auth_level=func.AuthLevel.FUNCTION)
+@app.queue_output(
+    arg_name="jobs",
+    queue_name=REPORT_QUEUE,
+    connection=REPORT_QUEUE_CONNECTION
+)
+def report(req: func.HttpRequest, jobs: func.Out[str]) -> func.HttpResponse:
+    org_id = req.route_params.get("org_id")
+    layout = requested_layout(req)
+    error = layout_error(layout)
+    if error:
+        return layout_error_response(error)
+
+    try:
+        if wants_queue(req):
+            return enqueue_report(org_id, jobs, layout)
+
+        refresh = wants_refresh(req)
+        if wants_stream(req):
+            pdf = generate_pdf(
+                stream_controls(org_id, refresh), stream=True, layout=layout
+            )
+            return pdf_response(org_id, pdf.read())
+
+        controls = fetch_controls(org_id, refresh=refresh)
+        etag = report_etag(controls, layout)
+        if etag_matches(req, etag):
+            return not_modified_response(etag)
+        _, body = render_report(controls, layout, etag)
+        return pdf_response(org_id, body, etag)
+
+    except Exception as e:
+        logging.exception("Failed to generate report")
+        return error_response(e)
+
+
+@app.route(route="report/async/{org_id}", auth_level=func.AuthLevel.FUNCTION)
+async def report_async(req: func.HttpRequest) -> func.HttpResponse:
+    org_id = req.route_params.get("org_id")
+    layout = requested_layout(req)
+    error = layout_error(layout)
+    if error:
+        return layout_error_response(error)
+
+    try:
+        controls = await fetch_controls_async(org_id, refresh=wants_refresh(req))
+        # Hashing and rendering are CPU-bound; keep them off the event loop.
+        etag = await asyncio.to_thread(report_etag, controls, layout)
+        if etag_matches(req, etag):
+            return not_modified_response(etag)
+        _, body = await asyncio.to_thread(render_report, controls, layout, etag)
+        return pdf_response(org_id, body, etag)
+
+    except Exception as e:
+        logging.exception("Failed to generate report")
+        return error_response(e)
+
+
+if PDF_HTTP_STREAMING:
+    from azurefunctions.extensions.http.fastapi import (
+        Request,
+        Response,
+        StreamingResponse
+    )
+
+    @app.route(route="report/stream/{org_id}", auth_level=func.AuthLevel.FUNCTION)
+    async def report_stream(req: Request) -> StreamingResponse:
+        org_id = req.path_params.get("org_id")
+
+        try:
+            controls = await fetch_controls_async(org_id)
+            pdf = await asyncio.to_thread(
+                generate_pdf, controls, out=spool_file()
+            )
+
+            return StreamingResponse(
+                iter_pdf_chunks(pdf),
+                media_type="application/pdf",
+                headers={
+                    "Content-Disposition": f'attachment; filename="controls_{org_id}.pdf"'
+                }
+            )
+
+        except Exception as e:
+            logging.exception("Failed to generate report")
+            return Response(
+                f"Error generating report: {str(e)}",
+                status_code=500
+            )
+
+
+@app.route(route="orchestrators/report/{org_id}", auth_level=func.AuthLevel.FUNCTION)
+@app.durable_client_input(client_name="client")
+async def start_report_orchestration(
+    req: func.HttpRequest,
+    client: df.DurableOrchestrationClient
+) -> func.HttpResponse:
+    org_id = req.route_params.get("org_id")
+    instance_id = await client.start_new(
+        "report_orchestrator", client_input={"org_id": org_id}
+    )
+    logging.info("Started report orchestration %s for org %s", instance_id, org_id)
+    return client.create_check_status_response(req, instance_id)
+
+
+@app.route(route="reports/{org_id}/{report_id}", auth_level=func.AuthLevel.FUNCTION)
+def download_report(req: func.HttpRequest) -> func.HttpResponse:
+    org_id = req.route_params.get("org_id")
+    report_id = req.route_params.get("report_id")
+
+    body = read_blob(report_blob_name(org_id, report_id))
+    if body is not None:
+        return pdf_response(org_id, body)
+
+    error = read_blob(report_error_blob_name(org_id, report_id))
+    if error is not None:
+        return func.HttpResponse(error, status_code=500, mimetype="application/json")
+    return func.HttpResponse("Report not found or not ready yet", status_code=404)
+
+
+@app.route(
+    route="reports/batch",
+    methods=["POST"],
+    auth_level=func.AuthLevel.FUNCTION
+)
+@app.queue_output(
+    arg_name="jobs",
+    queue_name=REPORT_QUEUE,
+    connection=REPORT_QUEUE_CONNECTION
+)
+def report_batch(req: func.HttpRequest, jobs: func.Out[List[str]]) -> func.HttpResponse:
+    try:
+        body = req.get_json()
+    except ValueError:
+        body = None
+
+    org_ids = body.get("org_ids") if isinstance(body, dict) else None
+    if not isinstance(org_ids, list) or not org_ids:
+        return func.HttpResponse(
+            'Expected a JSON body like {"org_ids": ["..."]}',
+            status_code=400
+        )
+
+    org_ids = list(dict.fromkeys(str(org_id) for org_id in org_ids))
+    if len(org_ids) > BATCH_MAX_ORGS:
+        return func.HttpResponse(
+            f"At most {BATCH_MAX_ORGS} org_ids per batch",
+            status_code=400
+        )
+
+    try:
+        if wants_queue(req) or len(org_ids) > BATCH_ZIP_MAX_ORGS:
+            return enqueue_batch(org_ids, jobs)
+
+        archive = generate_batch_zip(org_ids)
+
+        return func.HttpResponse(
+            archive.read(),
+            mimetype="application/zip",
+            headers={
+                "Content-Disposition": 'attachment; filename="controls_batch.zip"'
+            }
+        )
+
+    except Exception as e:
+        logging.exception("Failed to generate batch report")
+        return error_response(e)
+
+
+@app.route(
+    route="report/{org_id}/cache",
+    methods=["DELETE"],
+    auth_level=func.AuthLevel.FUNCTION
+)
+def invalidate_report_cache(req: func.HttpRequest) -> func.HttpResponse:
+    org_id = req.route_params.get("org_id")
+    invalidate_controls(org_id)
+    return func.HttpResponse(status_code=204)
+
+
+def query_flag(req, name, default=False):
+    value = req.params.get(name, "true" if default else "false")
+    return value.lower() in ("1", "true", "yes")
+
+
+def wants_stream(req):
+    return query_flag(req, "stream", REPORT_STREAMING)
+
+
+def wants_refresh(req):
+    return query_flag(req, "refresh")
+
+
+def wants_queue(req):
+    return query_flag(req, "queue", REPORT_QUEUE_DEFAULT)
+
+
+def requested_layout(req):
+    return req.params.get("layout", REPORT_LAYOUT).lower()
+
+
+def layout_error(layout):
+    if layout not in REPORT_LAYOUTS:
+        return f"Unknown layout '{layout}', expected one of: {', '.join(REPORT_LAYOUTS)}"
+    if layout == "table":
+        try:
+            table_column_widths()
+        except ValueError as e:
+            return str(e)
+    return None
+
+
+def layout_error_response(error):
+    return func.HttpResponse(error, status_code=400)
+
+
+def etag_matches(req, etag):
+    header = req.headers.get("If-None-Match") or ""
+    tags = {tag.strip().removeprefix("W/").strip('"') for tag in header.split(",")}
+    return etag in tags or "*" in tags
+
+
+def pdf_response(org_id, body, etag=None):
+    headers = {
+        "Content-Disposition": f'attachment; filename="controls_{org_id}.pdf"'
+    }
+    if etag is not None:
+        headers["ETag"] = f'"{etag}"'
+    return func.HttpResponse(
+        body,
+        mimetype="application/pdf",
+        headers=headers
+    )
+
+
+def not_modified_response(etag):
+    return func.HttpResponse(status_code=304, headers={"ETag": f'"{etag}"'})
+
+
+def error_response(e):
+    return func.HttpResponse(
+        f"Error generating report: {str(e)}",
+        status_code=500
+    )
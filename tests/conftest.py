@@ -0,0 +1,40 @@
+import pytest
+
+import function_app
+from function_app import Control
+
+
+@pytest.fixture
+def make_control():
+    # Builds Control records; the id defaults to the identifier.
+    def make(identifier="A.1", attributes=("1",), description="Description",
+             id=None, name="Name", effectiveness="Effective"):
+        return Control(
+            identifier if id is None else id, identifier, name, description,
+            "Org", None, attributes, effectiveness
+        )
+    return make
+
+
+class FakeClock:
+    # Stands in for the time module inside function_app.
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(function_app, "time", clock)
+    return clock
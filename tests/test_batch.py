@@ -0,0 +1,91 @@
+import io
+import json
+import zipfile
+
+import azure.functions as func
+import pytest
+
+import function_app
+from function_app import report_batch, report_blob_name, safe_name
+
+
+class FakeOut:
+    def __init__(self):
+        self.value = None
+
+    def set(self, value):
+        self.value = value
+
+
+def batch_request(body, params=None):
+    return func.HttpRequest(
+        "POST", "/api/reports/batch", body=json.dumps(body).encode(), params=params or {}
+    )
+
+
+@pytest.fixture
+def fetch(monkeypatch, make_control):
+    def fetch_controls(org_id, refresh=False, ttl=None):
+        if org_id == "broken":
+            raise RuntimeError("OneTrust is down")
+        return [make_control("A.1")]
+
+    monkeypatch.setattr(function_app, "fetch_controls", fetch_controls)
+    monkeypatch.setattr(function_app, "PDF_CACHE", None)
+    monkeypatch.setattr(function_app, "BATCH_ZIP_MAX_ORGS", 3)
+
+
+def test_small_batches_are_zipped_with_safe_entry_names(fetch):
+    jobs = FakeOut()
+    response = report_batch(batch_request({"org_ids": ["org1", "/../x", "broken"]}), jobs)
+
+    assert response.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(response.get_body()))
+    assert sorted(archive.namelist()) == [
+        "controls__.._x.pdf", "controls_org1.pdf", "manifest.json"
+    ]
+    manifest = json.loads(archive.read("manifest.json"))
+    assert manifest[2] == {"org_id": "broken", "error": "OneTrust is down"}
+    assert jobs.value is None
+
+
+def test_large_batches_are_queued_one_job_per_org(fetch, monkeypatch):
+    monkeypatch.setattr(function_app, "generate_batch_zip", pytest.fail)
+    jobs = FakeOut()
+    org_ids = [f"org{i}" for i in range(4)]
+
+    response = report_batch(batch_request({"org_ids": org_ids}), jobs)
+
+    assert response.status_code == 202
+    reports = json.loads(response.get_body())["reports"]
+    messages = [json.loads(message) for message in jobs.value]
+    assert [job["org_id"] for job in messages] == org_ids
+    assert [report["report_id"] for report in reports] == [job["report_id"] for job in messages]
+    assert reports[0]["location"] == f"/api/reports/org0/{reports[0]['report_id']}"
+
+
+def test_queue_flag_queues_small_batches(fetch):
+    jobs = FakeOut()
+    response = report_batch(batch_request({"org_ids": ["a/b"]}, {"queue": "true"}), jobs)
+
+    assert response.status_code == 202
+    report = json.loads(response.get_body())["reports"][0]
+    assert report["location"] == f"/api/reports/a%2Fb/{report['report_id']}"
+    assert len(jobs.value) == 1
+
+
+@pytest.mark.parametrize("body", [[], {"org_ids": []}, {"org_ids": "org1"}, {}])
+def test_invalid_bodies_are_rejected(body):
+    assert report_batch(batch_request(body), FakeOut()).status_code == 400
+
+
+def test_batches_over_the_cap_are_rejected(monkeypatch):
+    monkeypatch.setattr(function_app, "BATCH_MAX_ORGS", 2)
+    response = report_batch(batch_request({"org_ids": ["a", "b", "c"]}), FakeOut())
+    assert response.status_code == 400
+
+
+def test_org_ids_cannot_escape_report_storage():
+    assert safe_name("/../x") == "_.._x"
+    assert safe_name("..") == "_"
+    assert report_blob_name("../../etc", "r1") == "_.._etc/r1.pdf"
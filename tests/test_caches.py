@@ -0,0 +1,74 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from function_app import DiskCache, MemoryCache, TieredCache, build_cache
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryCache(2, 60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_memory_cache_expires_entries():
+    cache = MemoryCache(2, 60)
+    cache.set("a", 1, ttl=-1)
+    assert cache.get("a") is None
+
+
+def test_memory_cache_evicts_to_fit_max_bytes():
+    cache = MemoryCache(10, 60, max_bytes=10)
+    cache.set("a", b"12345")
+    cache.set("b", b"123456")
+    assert cache.get("a") is None
+    assert cache.get("b") == b"123456"
+    cache.set("c", b"x" * 11)
+    assert cache.get("c") is None
+
+
+def test_tiered_cache_promotes_with_remaining_lifetime(tmp_path):
+    memory = MemoryCache(2, 900)
+    disk = DiskCache(str(tmp_path), 900)
+    disk.set("a", {"v": 1}, ttl=5)
+
+    cache = TieredCache(memory, disk)
+    assert cache.get("a") == {"v": 1}
+
+    expires, value = memory.get_entry("a")
+    assert value == {"v": 1}
+    assert expires <= time.time() + 5
+
+
+def test_tiered_cache_does_not_promote_expired_entries(tmp_path):
+    memory = MemoryCache(2, 900)
+    disk = DiskCache(str(tmp_path), 900)
+    disk.set("a", 1, ttl=-1)
+
+    cache = TieredCache(memory, disk)
+    assert cache.get("a") is None
+    assert memory.get("a") is None
+
+
+def test_disk_cache_concurrent_writers_do_not_collide(tmp_path):
+    # Two caches on one directory stand in for instances sharing CACHE_DIR.
+    caches = [DiskCache(str(tmp_path), 60), DiskCache(str(tmp_path), 60)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda i: caches[i % 2].set("key", {"i": i}), range(200)))
+
+    assert caches[0].get("key")["i"] in range(200)
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_unknown_cache_backend_falls_back_to_memory(caplog):
+    with caplog.at_level(logging.ERROR):
+        cache = build_cache("dsik", "controls", 4, 60)
+
+    assert isinstance(cache, MemoryCache)
+    assert "Unknown controls cache backend dsik" in caplog.text
@@ -0,0 +1,144 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+import pytest
+
+import function_app
+from function_app import (
+    ControlPage,
+    DiskCache,
+    fetch_all_controls_async,
+    iter_controls,
+    open_checkpoint
+)
+
+TOTAL_PAGES = 4
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_page(make_control, page):
+    return ControlPage(
+        [make_control(f"A.{page}.{i}", id=f"{page}-{i}") for i in range(2)],
+        TOTAL_PAGES
+    )
+
+
+EXPECTED = [f"{page}-{i}" for page in range(TOTAL_PAGES) for i in range(2)]
+
+
+class FakeApi:
+    # Serves pages, failing each page listed in fail_once the first time.
+    def __init__(self, make_control, fail_once=()):
+        self.make_control = make_control
+        self.fetched = []
+        self.fail_once = set(fail_once)
+
+    def page(self, page):
+        self.fetched.append(page)
+        if page in self.fail_once:
+            self.fail_once.discard(page)
+            raise ConnectionError(f"page {page} failed")
+        return make_page(self.make_control, page)
+
+
+@pytest.fixture
+def api(monkeypatch, tmp_path, make_control):
+    api = FakeApi(make_control)
+    monkeypatch.setattr(function_app, "CHECKPOINTS", DiskCache(str(tmp_path), 3600))
+    monkeypatch.setattr(function_app, "FETCH_WORKERS", 1)
+    monkeypatch.setattr(
+        function_app, "fetch_first_page",
+        lambda org_id, modified_since=None: (50, api.page(0))
+    )
+    monkeypatch.setattr(
+        function_app, "fetch_page",
+        lambda org_id, page, size, modified_since=None: api.page(page)
+    )
+
+    async def fetch_first_page_async(client, org_id, modified_since=None):
+        return 50, api.page(0)
+
+    async def fetch_page_async(client, org_id, page, size, modified_since=None):
+        return api.page(page)
+
+    monkeypatch.setattr(function_app, "get_async_client", lambda: None)
+    monkeypatch.setattr(function_app, "fetch_first_page_async", fetch_first_page_async)
+    monkeypatch.setattr(function_app, "fetch_page_async", fetch_page_async)
+    return api
+
+
+def ids(controls):
+    return [control.id for control in controls]
+
+
+def test_interrupted_fetch_resumes_from_checkpoint(api):
+    api.fail_once = {2}
+    with pytest.raises(ConnectionError):
+        list(iter_controls("org1"))
+    assert api.fetched == [0, 1, 2]
+
+    api.fetched.clear()
+    assert ids(iter_controls("org1")) == EXPECTED
+    assert api.fetched == [2, 3]
+
+    checkpoint, resumed = open_checkpoint("org1")
+    assert resumed is None
+
+
+def test_refresh_does_not_resume(api):
+    api.fail_once = {2}
+    with pytest.raises(ConnectionError):
+        list(iter_controls("org1"))
+
+    api.fetched.clear()
+    assert ids(iter_controls("org1", resume=False)) == EXPECTED
+    assert api.fetched == [0, 1, 2, 3]
+
+
+def test_async_fetch_resumes_from_checkpoint(api):
+    api.fail_once = {3}
+    with pytest.raises(ConnectionError):
+        asyncio.run(fetch_all_controls_async("org1"))
+
+    api.fetched.clear()
+    assert ids(asyncio.run(fetch_all_controls_async("org1"))) == EXPECTED
+    assert api.fetched == [3]
+
+
+def test_async_refresh_does_not_resume(api):
+    api.fail_once = {3}
+    with pytest.raises(ConnectionError):
+        asyncio.run(fetch_all_controls_async("org1"))
+
+    api.fetched.clear()
+    assert ids(asyncio.run(fetch_all_controls_async("org1", resume=False))) == EXPECTED
+    assert sorted(api.fetched) == [0, 1, 2, 3]
+
+
+def test_checkpoints_are_off_by_default():
+    assert function_app.CHECKPOINT_BACKEND == "none"
+    assert function_app.CHECKPOINTS is None
+
+
+def import_checkpoints(backend):
+    result = subprocess.run(
+        [sys.executable, "-c",
+         "import function_app as fa; print(type(fa.CHECKPOINTS).__name__)"],
+        cwd=ROOT, env={**os.environ, "CHECKPOINT_BACKEND": backend},
+        capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stderr
+    return result.stdout.strip(), result.stderr
+
+
+def test_blob_checkpoint_backend_imports():
+    out, _ = import_checkpoints("blob")
+    assert out == "BlobCache"
+
+
+def test_unknown_checkpoint_backend_turns_checkpoints_off():
+    out, err = import_checkpoints("bolb")
+    assert out == "NoneType"
+    assert "Unknown CHECKPOINT_BACKEND bolb" in err
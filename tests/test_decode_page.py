@@ -0,0 +1,47 @@
+import json
+import logging
+
+import pytest
+
+import function_app
+from function_app import decode_page, parse_page
+
+PAGE = {
+    "totalPages": 2,
+    "content": [
+        {
+            "id": "1",
+            "control": {"identifier": "A.1", "name": "Name", "description": "Text",
+                        "orgGroupName": "Group"},
+            "primaryEntity": {"name": "Entity"},
+            "effectivenessInfo": {"name": "Effective"},
+            "attributes": {
+                "score": [{"value": "3"}],
+                "owner": [{"value": {"name": "Alice"}}],
+                "other": "scalar",
+                "nested": {"a": [1, 2]},
+            },
+        },
+        {
+            "id": "2",
+            "control": None,
+            "attributes": {"score": [{"value": "0"}], "owner": []},
+        },
+        {"id": "3"},
+    ],
+}
+
+
+@pytest.mark.parametrize("decoder", ["msgspec", "orjson", "json"])
+def test_decoders_match_parse_page(monkeypatch, caplog, decoder):
+    monkeypatch.setattr(function_app, "ATTRIBUTE_KEYS", ("score", "owner"))
+    monkeypatch.setattr(function_app, "JSON_DECODER", decoder)
+
+    with caplog.at_level(logging.WARNING):
+        page = decode_page(json.dumps(PAGE).encode())
+
+    expected = parse_page(PAGE)
+    assert page.total_pages == expected.total_pages == 2
+    assert [c.to_list() for c in page.controls] == [c.to_list() for c in expected.controls]
+    assert page.controls[0].attributes == ("3", {"name": "Alice"})
+    assert not caplog.records
@@ -0,0 +1,106 @@
+import asyncio
+import threading
+
+import pytest
+
+import function_app
+from function_app import MemoryCache, fetch_controls, fetch_controls_async
+
+
+@pytest.fixture
+def sync(monkeypatch, clock):
+    monkeypatch.setattr(function_app, "INCREMENTAL_SYNC", True)
+    monkeypatch.setattr(function_app, "INCREMENTAL_SKEW", 300)
+    monkeypatch.setattr(function_app, "INCREMENTAL_FULL_SYNC_INTERVAL", 24 * 3600)
+    monkeypatch.setattr(function_app, "SNAPSHOTS", MemoryCache(4, 48 * 3600))
+    monkeypatch.setattr(function_app, "CONTROLS_CACHE", None)
+    return function_app.SNAPSHOTS
+
+
+class FakeApi:
+    # iter_controls stand-in: serves `changes` and records the watermark.
+    def __init__(self, monkeypatch):
+        self.since = []
+        self.changes = []
+        monkeypatch.setattr(function_app, "iter_controls", self.iter_controls)
+
+    def iter_controls(self, org_id, modified_since=None, resume=True):
+        self.since.append(modified_since)
+        return iter(self.changes)
+
+
+def names(controls):
+    return {control.id: control.name for control in controls}
+
+
+def test_first_sync_is_full_and_stores_a_watermark(monkeypatch, sync, clock, make_control):
+    api = FakeApi(monkeypatch)
+    api.changes = [make_control("A.1"), make_control("A.2")]
+
+    controls = fetch_controls("org1")
+
+    assert api.since == [None]
+    assert names(controls) == {"A.1": "Name", "A.2": "Name"}
+    snapshot = sync.get(function_app.snapshot_key("org1"))
+    assert snapshot["watermark"] == clock.now - 300
+    assert snapshot["full_sync"] == clock.now
+
+
+def test_later_syncs_merge_changes_since_the_watermark(monkeypatch, sync, clock, make_control):
+    api = FakeApi(monkeypatch)
+    api.changes = [make_control("A.1"), make_control("A.2")]
+    fetch_controls("org1")
+    first_sync = clock.now
+
+    clock.now += 600
+    api.changes = [make_control("A.2", name="Renamed"), make_control("A.3")]
+    controls = fetch_controls("org1")
+
+    assert api.since == [None, first_sync - 300]
+    assert names(controls) == {"A.1": "Name", "A.2": "Renamed", "A.3": "Name"}
+    snapshot = sync.get(function_app.snapshot_key("org1"))
+    assert snapshot["watermark"] == clock.now - 300
+    assert snapshot["full_sync"] == first_sync
+
+
+def test_full_sync_interval_drops_deleted_controls(monkeypatch, sync, clock, make_control):
+    api = FakeApi(monkeypatch)
+    api.changes = [make_control("A.1"), make_control("A.2")]
+    fetch_controls("org1")
+
+    clock.now += 24 * 3600 + 1
+    api.changes = [make_control("A.2")]
+    controls = fetch_controls("org1")
+
+    assert api.since[-1] is None
+    assert names(controls) == {"A.2": "Name"}
+    assert sync.get(function_app.snapshot_key("org1"))["full_sync"] == clock.now
+
+
+def test_async_sync_merges_off_the_event_loop(monkeypatch, sync, clock, make_control):
+    since = []
+    changes = [[make_control("A.1"), make_control("A.2")],
+               [make_control("A.2", name="Renamed")]]
+    threads = set()
+
+    async def fetch_all_controls_async(org_id, modified_since=None, resume=True):
+        since.append(modified_since)
+        return changes[len(since) - 1]
+
+    def record(function):
+        def wrapper(*args):
+            threads.add(threading.get_ident())
+            return function(*args)
+        return wrapper
+
+    monkeypatch.setattr(function_app, "fetch_all_controls_async", fetch_all_controls_async)
+    for name in ("get_cached_controls", "cache_controls", "start_sync", "finish_sync"):
+        monkeypatch.setattr(function_app, name, record(getattr(function_app, name)))
+
+    asyncio.run(fetch_controls_async("org1"))
+    clock.now += 600
+    controls = asyncio.run(fetch_controls_async("org1"))
+
+    assert since == [None, 1000.0 - 300]
+    assert names(controls) == {"A.1": "Name", "A.2": "Renamed"}
+    assert threads and threading.get_ident() not in threads
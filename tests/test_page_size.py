@@ -0,0 +1,98 @@
+import asyncio
+
+import httpx
+import pytest
+import requests
+
+import function_app
+from function_app import ControlPage, MemoryCache, fetch_first_page, fetch_first_page_async
+
+
+def rejected(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"{status} error", response=response)
+
+
+@pytest.fixture
+def sizes(monkeypatch):
+    monkeypatch.setattr(function_app, "PAGE_SIZE_MAX", 500)
+    monkeypatch.setattr(function_app, "PAGE_SIZE_MIN", 50)
+    monkeypatch.setattr(function_app, "_page_sizes", MemoryCache(16, 3600))
+    return function_app._page_sizes
+
+
+def fake_fetch(monkeypatch, max_size, error, calls):
+    def fetch_page(org_id, page, size, modified_since=None, retry_timeouts=True):
+        calls.append((size, retry_timeouts))
+        if size > max_size:
+            raise error
+        return ControlPage([], 1)
+
+    monkeypatch.setattr(function_app, "fetch_page", fetch_page)
+
+
+def test_rejected_sizes_step_down_and_are_remembered(monkeypatch, sizes):
+    calls = []
+    fake_fetch(monkeypatch, 125, rejected(413), calls)
+
+    size, _ = fetch_first_page("org1")
+
+    assert size == 125
+    assert calls == [(500, False), (250, False), (125, False)]
+    calls.clear()
+    assert fetch_first_page("org1")[0] == 125
+    assert calls == [(125, False)]
+
+
+def test_timeouts_step_down_too(monkeypatch, sizes):
+    calls = []
+    fake_fetch(monkeypatch, 250, requests.Timeout("slow"), calls)
+    assert fetch_first_page("org1")[0] == 250
+
+
+def test_remembered_size_expires(monkeypatch, sizes):
+    calls = []
+    monkeypatch.setattr(function_app, "_page_sizes", MemoryCache(16, -1))
+    fake_fetch(monkeypatch, 125, rejected(413), calls)
+    fetch_first_page("org1")
+
+    calls.clear()
+    fake_fetch(monkeypatch, 500, rejected(413), calls)
+    assert fetch_first_page("org1")[0] == 500
+
+
+def test_other_errors_are_not_page_size_signals(monkeypatch, sizes):
+    calls = []
+    fake_fetch(monkeypatch, 0, rejected(401), calls)
+    with pytest.raises(requests.HTTPError):
+        fetch_first_page("org1")
+    assert calls == [(500, False)]
+
+
+def test_the_minimum_size_retries_timeouts_and_then_fails(monkeypatch, sizes):
+    calls = []
+    fake_fetch(monkeypatch, 0, rejected(413), calls)
+    with pytest.raises(requests.HTTPError):
+        fetch_first_page("org1")
+    assert [size for size, _ in calls] == [500, 250, 125, 62, 50]
+    assert calls[-1] == (50, True)
+
+
+def test_async_steps_down_and_remembers(monkeypatch, sizes):
+    calls = []
+
+    async def fetch_page_async(client, org_id, page, size, modified_since=None,
+                               retry_timeouts=True):
+        calls.append(size)
+        if size > 250:
+            raise httpx.ReadTimeout("slow")
+        return ControlPage([], 1)
+
+    monkeypatch.setattr(function_app, "fetch_page_async", fetch_page_async)
+
+    size, _ = asyncio.run(fetch_first_page_async(None, "org1"))
+
+    assert size == 250
+    assert calls == [500, 250]
+    assert sizes.get("org1") == 250
@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+import function_app
+from function_app import TokenBucket
+
+
+def test_burst_is_served_without_waiting(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.slept == []
+
+
+def test_waiters_past_the_burst_are_spaced_by_the_rate(clock):
+    bucket = TokenBucket(rate=2, capacity=1)
+    assert bucket._reserve() == 0
+    assert bucket._reserve() == pytest.approx(0.5)
+    assert bucket._reserve() == pytest.approx(1.0)
+
+
+def test_tokens_refill_over_time_up_to_capacity(clock):
+    bucket = TokenBucket(rate=2, capacity=2)
+    bucket._reserve()
+    bucket._reserve()
+    clock.now += 60
+    assert bucket._reserve() == 0
+    assert bucket._reserve() == 0
+    assert bucket._reserve() == pytest.approx(0.5)
+
+
+def test_pause_holds_every_caller(clock):
+    bucket = TokenBucket(rate=100, capacity=10)
+    bucket.pause(5)
+    assert bucket._reserve() == pytest.approx(5)
+    bucket.pause(1)
+    assert bucket._reserve() == pytest.approx(5)
+
+
+def test_zero_rate_disables_the_limit_but_not_pauses(clock):
+    bucket = TokenBucket(rate=0, capacity=1)
+    for _ in range(10):
+        assert bucket._reserve() == 0
+    bucket.pause(2)
+    assert bucket._reserve() == pytest.approx(2)
+
+
+def test_acquire_async_sleeps_off_the_deficit(clock, monkeypatch):
+    slept = []
+
+    async def fake_sleep(seconds):
+        slept.append(seconds)
+
+    monkeypatch.setattr(function_app.asyncio, "sleep", fake_sleep)
+    bucket = TokenBucket(rate=4, capacity=1)
+
+    async def run():
+        await bucket.acquire_async()
+        await bucket.acquire_async()
+
+    asyncio.run(run())
+    assert slept == [pytest.approx(0.25)]
@@ -0,0 +1,49 @@
+from io import BytesIO
+
+from pypdf import PdfReader
+
+import function_app
+from function_app import (
+    BODY_FONT,
+    get_render_pool,
+    paint_pages,
+    paint_pages_parallel,
+    paint_report_pages
+)
+
+PAGES = [[(BODY_FONT, f"line {page}.{line}") for line in range(3)] for page in range(5)]
+
+
+def page_texts(data):
+    return [page.extract_text() for page in PdfReader(BytesIO(data)).pages]
+
+
+def test_parallel_render_matches_serial_and_reuses_the_pool(monkeypatch):
+    monkeypatch.setattr(function_app, "RENDER_PROCESSES", 2)
+    monkeypatch.setattr(function_app, "RENDER_CHUNK_PAGES", 2)
+    serial, parallel = BytesIO(), BytesIO()
+
+    paint_pages(PAGES, serial)
+    paint_pages_parallel(PAGES, parallel)
+
+    assert page_texts(parallel.getvalue()) == page_texts(serial.getvalue())
+    assert "Page 5" in page_texts(parallel.getvalue())[-1]
+    assert get_render_pool() is get_render_pool()
+
+
+def test_renders_serially_when_no_parallel_slot_is_free(monkeypatch):
+    def fail(pages, out):
+        raise AssertionError("used the render pool")
+
+    monkeypatch.setattr(function_app, "RENDER_PROCESSES", 2)
+    monkeypatch.setattr(function_app, "RENDER_PARALLEL_MIN_PAGES", 1)
+    monkeypatch.setattr(function_app, "paint_pages_parallel", fail)
+    out = BytesIO()
+
+    assert function_app._render_slots.acquire(blocking=False)
+    try:
+        paint_report_pages(PAGES, out)
+    finally:
+        function_app._render_slots.release()
+
+    assert len(page_texts(out.getvalue())) == 5
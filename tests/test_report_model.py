@@ -0,0 +1,57 @@
+import os
+import subprocess
+import sys
+
+import function_app
+from function_app import build_report_model, report_lines
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_attribute_index_holds_one_value_per_row(monkeypatch, make_control):
+    monkeypatch.setattr(function_app, "ATTRIBUTE_KEYS", ("a", "b"))
+    monkeypatch.setattr(function_app, "ATTRIBUTE_LABELS", ("A", "B"))
+    monkeypatch.setattr(function_app, "SCORE_ATTRIBUTE", "b")
+    controls = [make_control("1", ["x", "2"]), make_control("2", [[1, 2], "4"])]
+
+    model = build_report_model(controls)
+
+    assert model.attributes["a"].shape == (2,)
+    assert model.attributes["a"][1] == [1, 2]
+    assert list(model.attributes["b"]) == ["2", "4"]
+    assert model.stats["mean"] == 3.0
+
+
+def test_report_lines_read_attributes_from_the_index(monkeypatch, make_control):
+    monkeypatch.setattr(function_app, "ATTRIBUTE_KEYS", ("a", "b"))
+    monkeypatch.setattr(function_app, "ATTRIBUTE_LABELS", ("A", "B"))
+    monkeypatch.setattr(function_app, "SCORE_ATTRIBUTE", "b")
+    model = build_report_model([make_control("1", ["x", "2"])])
+    model.attributes["b"][0] = "from index"
+
+    lines = list(report_lines(model.company_name, model.rows, model.attributes))
+
+    assert f"{'A':<14}: x" in lines
+    assert f"{'B':<14}: from index" in lines
+
+
+def import_settings(**env):
+    result = subprocess.run(
+        [sys.executable, "-c",
+         "import function_app as fa; print(fa.ATTRIBUTE_KEYS, fa.SCORE_ATTRIBUTE)"],
+        cwd=ROOT, env={**os.environ, **env}, capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stderr
+    return result.stdout.strip(), result.stderr
+
+
+def test_unknown_score_attribute_falls_back_to_the_first_key():
+    out, err = import_settings(REPORT_ATTRIBUTES="a=A,b=B", SCORE_ATTRIBUTE="c")
+    assert out == "('a', 'b') a"
+    assert "SCORE_ATTRIBUTE c is not one of REPORT_ATTRIBUTES" in err
+
+
+def test_empty_report_attributes_fall_back_to_the_default():
+    out, err = import_settings(REPORT_ATTRIBUTES=" , =Label")
+    assert out == "('AttributeFormulaValue.value1_2',) AttributeFormulaValue.value1_2"
+    assert "REPORT_ATTRIBUTES has no attribute keys" in err
@@ -0,0 +1,60 @@
+import json
+
+import azure.functions as func
+import pytest
+
+import function_app
+from function_app import download_report, report_worker
+
+
+def job(org_id="org1", report_id="r1"):
+    return func.QueueMessage(
+        body=json.dumps({"org_id": org_id, "report_id": report_id}).encode()
+    )
+
+
+def download(org_id="org1", report_id="r1"):
+    return download_report(func.HttpRequest(
+        "GET", f"/api/reports/{org_id}/{report_id}", body=b"",
+        route_params={"org_id": org_id, "report_id": report_id}
+    ))
+
+
+@pytest.fixture
+def reports_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(function_app, "REPORTS_DIR", str(tmp_path))
+    monkeypatch.setattr(function_app, "PDF_CACHE", None)
+    return tmp_path
+
+
+def test_failed_job_is_reported_by_the_download_route(monkeypatch, reports_dir):
+    def fetch_controls(org_id, refresh=False):
+        raise RuntimeError("OneTrust is down")
+
+    monkeypatch.setattr(function_app, "fetch_controls", fetch_controls)
+    with pytest.raises(RuntimeError):
+        report_worker(job())
+
+    response = download()
+    assert response.status_code == 500
+    assert json.loads(response.get_body()) == {
+        "org_id": "org1", "report_id": "r1", "error": "OneTrust is down"
+    }
+
+
+def test_retried_job_clears_the_error(monkeypatch, reports_dir, make_control):
+    function_app.store_blob(function_app.report_error_blob_name("org1", "r1"), b"{}")
+    monkeypatch.setattr(
+        function_app, "fetch_controls", lambda org_id, refresh=False: [make_control()]
+    )
+
+    report_worker(job())
+
+    response = download()
+    assert response.status_code == 200
+    assert response.get_body().startswith(b"%PDF")
+    assert function_app.read_blob(function_app.report_error_blob_name("org1", "r1")) is None
+
+
+def test_unknown_report_is_not_found(reports_dir):
+    assert download(report_id="missing").status_code == 404
@@ -0,0 +1,101 @@
+import asyncio
+import time
+
+import azure.functions as func
+import pytest
+
+import function_app
+from function_app import report, report_async, report_etag
+
+
+@pytest.fixture
+def controls(make_control):
+    return [make_control(f"A.{i}", [str(i)]) for i in range(1, 4)]
+
+
+def request(headers=None):
+    return func.HttpRequest(
+        "GET", "/api/report/org1", body=b"",
+        route_params={"org_id": "org1"}, headers=headers or {}
+    )
+
+
+def fail_render(*args, **kwargs):
+    raise AssertionError("rendered a report for a 304")
+
+
+def test_report_returns_304_without_rendering(monkeypatch, controls):
+    monkeypatch.setattr(function_app, "fetch_controls", lambda org_id, refresh=False: controls)
+    monkeypatch.setattr(function_app, "PDF_CACHE", None)
+    monkeypatch.setattr(function_app, "generate_pdf", fail_render)
+
+    etag = report_etag(controls)
+    response = report(request({"If-None-Match": f'"{etag}"'}), None)
+
+    assert response.status_code == 304
+    assert response.headers["ETag"] == f'"{etag}"'
+
+
+def test_report_async_returns_304_without_rendering(monkeypatch, controls):
+
+    async def fetch(org_id, refresh=False):
+        return controls
+
+    monkeypatch.setattr(function_app, "fetch_controls_async", fetch)
+    monkeypatch.setattr(function_app, "PDF_CACHE", None)
+    monkeypatch.setattr(function_app, "generate_pdf", fail_render)
+
+    etag = report_etag(controls)
+    response = asyncio.run(report_async(request({"If-None-Match": f'W/"{etag}"'})))
+
+    assert response.status_code == 304
+
+
+def test_report_renders_on_etag_mismatch(monkeypatch, controls):
+    monkeypatch.setattr(function_app, "fetch_controls", lambda org_id, refresh=False: controls)
+    monkeypatch.setattr(function_app, "PDF_CACHE", None)
+
+    response = report(request({"If-None-Match": '"stale"'}), None)
+
+    assert response.status_code == 200
+    assert response.get_body().startswith(b"%PDF")
+    assert response.headers["ETag"] == f'"{report_etag(controls)}"'
+
+
+def test_prewarm_caches_controls_until_the_peak(monkeypatch, controls):
+    cache = function_app.MemoryCache(4, 900)
+    monkeypatch.setattr(function_app, "CONTROLS_CACHE", cache)
+    monkeypatch.setattr(function_app, "CONTROLS_CACHE_TTL", 900)
+    monkeypatch.setattr(function_app, "PREWARM_CACHE_TTL", 3 * 3600)
+    monkeypatch.setattr(function_app, "PREWARM_ORG_IDS", ["org1"])
+    monkeypatch.setattr(function_app, "INCREMENTAL_SYNC", False)
+    monkeypatch.setattr(function_app, "PDF_CACHE", None)
+    monkeypatch.setattr(function_app, "iter_controls", lambda org_id, resume=True: iter(controls))
+
+    function_app.prewarm_reports(None)
+
+    expires, cached = cache.get_entry(function_app.controls_cache_key("org1"))
+    assert cached == controls
+    assert expires > time.time() + 2 * 3600
+
+
+def test_etag_depends_on_the_render_configuration(monkeypatch, controls):
+    etag = report_etag(controls)
+    assert report_etag(controls) == etag
+    assert report_etag(controls, "table") != etag
+
+    monkeypatch.setattr(function_app, "ATTRIBUTE_LABELS", ("Renamed",))
+    assert report_etag(controls) != etag
+    monkeypatch.undo()
+
+    monkeypatch.setattr(function_app, "REPORT_RENDER_VERSION", 0)
+    assert report_etag(controls) != etag
+
+
+def test_etag_depends_on_the_score_attribute(monkeypatch, controls):
+    monkeypatch.setattr(function_app, "ATTRIBUTE_KEYS", ("a", "b"))
+    monkeypatch.setattr(function_app, "SCORE_ATTRIBUTE", "a")
+    etag = report_etag(controls)
+
+    monkeypatch.setattr(function_app, "SCORE_ATTRIBUTE", "b")
+    assert report_etag(controls) != etag
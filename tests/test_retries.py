@@ -0,0 +1,173 @@
+import asyncio
+from email.utils import formatdate
+
+import httpx
+import pytest
+import requests
+
+import function_app
+from function_app import parse_retry_after, post_with_retries, post_with_retries_async
+
+URL = "https://onetrust.example/api"
+
+
+class FakeLimiter:
+    def __init__(self):
+        self.acquired = 0
+        self.paused = []
+
+    def acquire(self):
+        self.acquired += 1
+
+    async def acquire_async(self):
+        self.acquired += 1
+
+    def pause(self, seconds):
+        self.paused.append(seconds)
+
+
+class FakeSession:
+    # Returns (or raises) the scripted outcomes in order.
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def post(self, url, json=None, timeout=None):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+class FakeClient(FakeSession):
+    async def post(self, url, json=None):
+        return FakeSession.post(self, url, json)
+
+
+def response(status, headers=None):
+    r = requests.Response()
+    r.status_code = status
+    r.headers.update(headers or {})
+    r.url = URL
+    return r
+
+
+def async_response(status, headers=None):
+    return httpx.Response(status, headers=headers, request=httpx.Request("POST", URL))
+
+
+@pytest.fixture
+def limiter(monkeypatch, clock):
+    limiter = FakeLimiter()
+    monkeypatch.setattr(function_app, "RATE_LIMITER", limiter)
+    monkeypatch.setattr(function_app, "RETRY_ATTEMPTS", 3)
+    monkeypatch.setattr(function_app, "RETRY_BASE_DELAY", 0.5)
+    monkeypatch.setattr(function_app, "RETRY_MAX_DELAY", 30)
+    return limiter
+
+
+@pytest.fixture
+def async_slept(monkeypatch):
+    slept = []
+
+    async def sleep(seconds):
+        slept.append(seconds)
+
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+    return slept
+
+
+def test_parse_retry_after_reads_seconds_and_http_dates(clock):
+    assert parse_retry_after(response(429, {"Retry-After": "12"})) == 12.0
+    assert parse_retry_after(response(429, {"Retry-After": "-3"})) == 0.0
+    date = formatdate(clock.now + 7, usegmt=True)
+    assert parse_retry_after(response(503, {"Retry-After": date})) == pytest.approx(7)
+    assert parse_retry_after(response(503, {"Retry-After": "soon"})) is None
+    assert parse_retry_after(response(503)) is None
+    assert parse_retry_after(None) is None
+
+
+def test_429_pauses_the_limiter_for_retry_after(monkeypatch, clock, limiter):
+    session = FakeSession(response(429, {"Retry-After": "4"}), response(200))
+    monkeypatch.setattr(function_app, "SESSION", session)
+
+    assert post_with_retries(URL, {}).status_code == 200
+    assert limiter.paused == [4.0]
+    assert clock.slept == [4.0]
+    assert limiter.acquired == session.calls == 2
+
+
+def test_server_errors_back_off_with_capped_jitter(monkeypatch, clock, limiter):
+    session = FakeSession(response(503), requests.ConnectionError(), response(200))
+    monkeypatch.setattr(function_app, "SESSION", session)
+
+    assert post_with_retries(URL, {}).status_code == 200
+    assert limiter.paused == []
+    assert 0 <= clock.slept[0] <= 0.5
+    assert 0 <= clock.slept[1] <= 1.0
+
+
+def test_gives_up_after_retry_attempts(monkeypatch, clock, limiter):
+    session = FakeSession(*[response(502) for _ in range(4)])
+    monkeypatch.setattr(function_app, "SESSION", session)
+
+    with pytest.raises(requests.HTTPError):
+        post_with_retries(URL, {})
+    assert session.calls == 4
+    assert len(clock.slept) == 3
+
+
+def test_connection_errors_are_raised_after_retry_attempts(monkeypatch, clock, limiter):
+    session = FakeSession(*[requests.ConnectionError() for _ in range(4)])
+    monkeypatch.setattr(function_app, "SESSION", session)
+
+    with pytest.raises(requests.ConnectionError):
+        post_with_retries(URL, {})
+    assert session.calls == 4
+
+
+def test_timeouts_are_not_retried_when_disabled(monkeypatch, clock, limiter):
+    session = FakeSession(requests.Timeout(), response(200))
+    monkeypatch.setattr(function_app, "SESSION", session)
+
+    with pytest.raises(requests.Timeout):
+        post_with_retries(URL, {}, retry_timeouts=False)
+    assert session.calls == 1
+    assert clock.slept == []
+
+
+def test_client_errors_are_not_retried(monkeypatch, clock, limiter):
+    session = FakeSession(response(400))
+    monkeypatch.setattr(function_app, "SESSION", session)
+
+    with pytest.raises(requests.HTTPError):
+        post_with_retries(URL, {})
+    assert session.calls == 1
+
+
+def test_async_429_pauses_the_limiter(clock, limiter, async_slept):
+    client = FakeClient(async_response(429, {"Retry-After": "2"}), async_response(200))
+
+    response = asyncio.run(post_with_retries_async(client, URL, {}))
+    assert response.status_code == 200
+    assert limiter.paused == [2.0]
+    assert async_slept == [2.0]
+
+
+def test_async_gives_up_after_retry_attempts(clock, limiter, async_slept):
+    client = FakeClient(*[httpx.ConnectError("down") for _ in range(4)])
+
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(post_with_retries_async(client, URL, {}))
+    assert client.calls == 4
+    assert len(async_slept) == 3
+
+
+def test_async_timeouts_are_not_retried_when_disabled(clock, limiter, async_slept):
+    client = FakeClient(httpx.ReadTimeout("slow"), async_response(200))
+
+    with pytest.raises(httpx.ReadTimeout):
+        asyncio.run(post_with_retries_async(client, URL, {}, retry_timeouts=False))
+    assert client.calls == 1
+    assert async_slept == []
@@ -0,0 +1,30 @@
+from function_app import identifier_sort_key
+
+
+def test_numbers_sort_numerically():
+    identifiers = ["A.10", "A.2", "A.1", "B.1", "A.1.3", "A.1.10"]
+    assert sorted(identifiers, key=identifier_sort_key) == [
+        "A.1", "A.1.3", "A.1.10", "A.2", "A.10", "B.1"
+    ]
+
+
+def test_numbers_sort_ahead_of_text():
+    identifiers = ["1.b", "1.a", "1.2", "1.10b", "1.10a"]
+    assert sorted(identifiers, key=identifier_sort_key) == [
+        "1.2", "1.10a", "1.10b", "1.a", "1.b"
+    ]
+
+
+def test_leading_zeros_break_ties_deterministically():
+    assert sorted(["1", "01"], key=identifier_sort_key) == ["01", "1"]
+
+
+def test_non_decimal_digits_are_text():
+    # "²".isdigit() is true, but int("²") raises.
+    assert identifier_sort_key("1.²") == ((((0, 1),), ((1, "²"),)), "1.²")
+    assert sorted(["1.²", "1.2"], key=identifier_sort_key) == ["1.2", "1.²"]
+
+
+def test_missing_identifiers_do_not_fail():
+    assert identifier_sort_key(None) == (((),), "")
+    assert identifier_sort_key(12) == (((),), "")
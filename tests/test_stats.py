@@ -0,0 +1,48 @@
+import math
+
+from function_app import build_report_model, parse_score, to_score_array
+
+
+def test_to_score_array_marks_unusable_values_as_nan():
+    scores = to_score_array(["3", "N/A", "junk", 2.5])
+    assert scores[0] == 3.0
+    assert math.isnan(scores[1])
+    assert math.isnan(scores[2])
+    assert scores[3] == 2.5
+
+
+def test_to_score_array_tolerates_dict_and_list_values():
+    scores = to_score_array(["3", {"a": 1}, [1, 2]])
+    assert scores[0] == 3.0
+    assert math.isnan(scores[1])
+    assert math.isnan(scores[2])
+
+
+def test_parse_score_rejects_non_numeric_values():
+    assert parse_score("1.5") == 1.5
+    assert parse_score("x") is None
+    assert parse_score({"a": 1}) is None
+
+
+def test_report_stats_average_scored_controls(make_control):
+    controls = [
+        make_control(f"A.{i}", [value])
+        for i, value in enumerate(["1", "N/A", "3", {"a": 1}])
+    ]
+    stats = build_report_model(controls).stats
+    assert stats["count"] == 2
+    assert stats["mean"] == 2.0
+    assert stats["by_effectiveness"]["Effective"]["count"] == 2
+
+
+def test_report_stats_ignore_non_finite_scores(make_control):
+    controls = [
+        make_control(f"A.{i}", [value])
+        for i, value in enumerate(["1", "Infinity", "-inf", "3", "nan"])
+    ]
+    assert math.isnan(to_score_array(["inf"])[0])
+
+    stats = build_report_model(controls).stats
+    assert stats["count"] == 2
+    assert stats["mean"] == 2.0
+    assert sum(stats["histogram"]["counts"]) == 2
@@ -0,0 +1,44 @@
+import function_app
+from function_app import ControlPage, stream_controls
+
+
+def test_stream_mode_reads_pages_lazily_by_default(monkeypatch, make_control):
+    fetched = []
+
+    def iter_pages(org_id, modified_since=None, resume=True):
+        for page in range(3):
+            fetched.append(page)
+            yield ControlPage(
+                [make_control(f"A.{page}", id=f"{page}")],
+                3
+            )
+
+    monkeypatch.setattr(function_app, "iter_pages", iter_pages)
+    monkeypatch.setattr(function_app, "CONTROLS_CACHE", None)
+
+    controls = stream_controls("org1")
+    assert next(iter(controls)).identifier == "A.0"
+    assert fetched == [0]
+
+
+def test_iter_pages_yields_every_page_in_order(monkeypatch, make_control):
+    total_pages = 7
+
+    def page(number):
+        return ControlPage(
+            [make_control(f"A.{number}", id=f"{number}")],
+            total_pages
+        )
+
+    monkeypatch.setattr(function_app, "FETCH_WORKERS", 2)
+    monkeypatch.setattr(function_app, "CHECKPOINTS", None)
+    monkeypatch.setattr(
+        function_app, "fetch_first_page", lambda org_id, modified_since=None: (50, page(0))
+    )
+    monkeypatch.setattr(
+        function_app, "fetch_page",
+        lambda org_id, number, size, modified_since=None: page(number)
+    )
+
+    pages = list(function_app.iter_pages("org1"))
+    assert [data.controls[0].id for data in pages] == [str(n) for n in range(total_pages)]
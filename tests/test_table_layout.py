@@ -0,0 +1,63 @@
+from io import BytesIO
+
+import azure.functions as func
+import pytest
+from pypdf import PdfReader
+
+import function_app
+from function_app import TEXT_WIDTH, generate_pdf, report, table_column_widths
+
+
+def use_attributes(monkeypatch, count):
+    keys = tuple(f"key{i}" for i in range(count))
+    monkeypatch.setattr(function_app, "ATTRIBUTE_KEYS", keys)
+    monkeypatch.setattr(function_app, "ATTRIBUTE_LABELS", tuple(f"Label {i}" for i in range(count)))
+    monkeypatch.setattr(function_app, "SCORE_ATTRIBUTE", keys[0])
+
+
+def render_table(controls):
+    body = generate_pdf(controls, layout="table").read()
+    return [page.extract_text() for page in PdfReader(BytesIO(body)).pages]
+
+
+def test_rows_taller_than_a_page_are_split(make_control):
+    description = " ".join(f"word{i}" for i in range(800))
+    assert len(description) > 5000
+
+    pages = render_table([
+        make_control("A.1", description=description),
+        make_control("A.2", description="short")
+    ])
+
+    assert len(pages) > 1
+    text = " ".join(pages)
+    assert "word0 " in text and "word799" in text
+    assert "Identifier" in pages[1]
+    assert "A.2" in pages[-1]
+
+
+def test_six_attribute_columns_fit_the_page(monkeypatch, make_control):
+    use_attributes(monkeypatch, 6)
+
+    widths = table_column_widths()
+
+    assert sum(widths) <= TEXT_WIDTH + 1e-6
+    assert len(widths) == 10
+    pages = render_table([make_control("A.1", tuple(str(i) for i in range(6)))])
+    assert "Label\n5" in pages[0]
+
+
+def test_too_many_attribute_columns_are_rejected(monkeypatch):
+    use_attributes(monkeypatch, 12)
+    monkeypatch.setattr(function_app, "fetch_controls", pytest.fail)
+
+    with pytest.raises(ValueError, match="cannot fit 12 attribute columns"):
+        table_column_widths()
+
+    response = report(
+        func.HttpRequest("GET", "/", body=b"", route_params={"org_id": "org1"},
+                         params={"layout": "table"}),
+        None
+    )
+    assert response.status_code == 400
+    assert b"cannot fit 12 attribute columns" in response.get_body()
@@ -0,0 +1,44 @@
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+import function_app
+from function_app import wrap_line, wrap_line_cached
+
+FONT = ("Helvetica", 10)
+
+
+def test_lines_fit_the_width():
+    text = "Lorem ipsum dolor sit amet, consectetur adipiscing elit " * 10
+    lines = wrap_line(text, *FONT, 200)
+    assert len(lines) > 1
+    assert all(stringWidth(line, *FONT) <= 200 for line in lines)
+    assert " ".join(lines).split() == text.split()
+
+
+def test_short_text_is_a_single_line():
+    assert wrap_line("Value : 3", *FONT, 200) == ("Value : 3",)
+
+
+def test_blank_text_yields_no_lines():
+    assert wrap_line("", *FONT, 200) == ()
+    assert wrap_line(" \t\n", *FONT, 200) == ()
+
+
+def test_control_characters_become_spaces():
+    assert wrap_line("a\tb\nc", *FONT, 200) == ("a b c",)
+
+
+def test_words_wider_than_the_line_are_hard_broken():
+    word = "x" * 200
+    lines = wrap_line(word, *FONT, 100)
+    assert "".join(lines) == word
+    assert all(stringWidth(line, *FONT) <= 100 for line in lines)
+
+
+def test_only_short_text_is_memoized(monkeypatch):
+    monkeypatch.setattr(function_app, "WRAP_CACHE_MAX_CHARS", 20)
+    wrap_line_cached.cache_clear()
+
+    wrap_line("short text", *FONT, 200)
+    wrap_line("long text " * 10, *FONT, 200)
+
+    assert wrap_line_cached.cache_info().currsize == 1